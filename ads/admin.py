@@ -1,8 +1,9 @@
 from django.contrib import admin
+from dramas.admin import CatalogVersionAdminMixin
 from .models import AdConfig
 
 @admin.register(AdConfig)
-class AdConfigAdmin(admin.ModelAdmin):
+class AdConfigAdmin(CatalogVersionAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'ad_type', 'sequence', 'show_random', 'random_min', 'random_max', 'is_active', 'updated_at')
     list_editable = ('sequence', 'show_random', 'random_min', 'random_max', 'is_active')
     search_fields = ('name',)
@@ -1,8 +1,10 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from dramas.response_cache import cached_response
 from .models import AdConfig
 
 class ActiveAdsView(APIView):
+    @cached_response('active-ads')
     def get(self, request):
         active_ads = AdConfig.objects.filter(is_active=True)
         
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dramaflux.settings')
+# Serve /api/proxy/ through the non-blocking views unless told otherwise
+os.environ.setdefault('DRAMAFLUX_PROXY_MODE', 'async')
 
 application = get_asgi_application()
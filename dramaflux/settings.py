@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -67,11 +68,159 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'dramas.metrics.proxy_metrics_middleware',
 ]
 
 # CORS settings - allow all origins in development
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Upstream HTTP client (dramas/upstream.py), shared by the API service, the
+# proxy and the sync job
+UPSTREAM_CONNECT_TIMEOUT = 5  # seconds
+UPSTREAM_API_TIMEOUT = 30  # seconds, read deadline for nanodrama API calls
+UPSTREAM_POOL_HOSTS = 20  # hosts with a keep-alive pool (sync client)
+UPSTREAM_POOL_PER_HOST = 10  # connections per host (sync client)
+UPSTREAM_ASYNC_PER_HOST = 100  # connections per host (async client)
+UPSTREAM_DNS_CACHE_TTL = 300  # seconds (async client)
+
+# Segment fetches: per-host circuit breaker and hedged requests
+UPSTREAM_BREAKER_FAILURES = 5  # consecutive failures (errors, timeouts, 5xx) that open the breaker
+UPSTREAM_BREAKER_COOLDOWN = 15  # seconds open before a single probe request is let through
+UPSTREAM_BREAKER_PROBE_TIMEOUT = 30  # seconds after which an unanswered probe no longer blocks the next one
+UPSTREAM_LATENCY_WINDOW = 200  # time-to-first-byte samples kept per host
+UPSTREAM_HEDGING_ENABLED = False  # fire a second request when the first is slower than the host's p95
+UPSTREAM_HEDGE_MIN_SAMPLES = 20  # no hedging until a host has this many samples
+UPSTREAM_HEDGE_MIN_DELAY = 0.05  # seconds, floor for the hedge delay
+UPSTREAM_HEDGE_WORKERS = 8  # threads sending hedge requests (sync client)
+
+# HLS proxy settings (/api/proxy/)
+# 'sync' serves the proxy through the blocking views (gunicorn sync workers),
+# 'async' through dramas/async_views.py. dramaflux/asgi.py defaults to 'async'
+# so both apps can run side by side during rollout.
+PROXY_MODE = os.environ.get('DRAMAFLUX_PROXY_MODE', 'sync')
+PROXY_TIMEOUT = 10  # seconds, upstream read deadline for playlists/segments
+PROXY_CHUNK_SIZE = 64 * 1024
+PROXY_MAX_CONNECTIONS = 500  # per async worker
+# 'python' relays segment bytes through the worker, 'accel' answers with an
+# X-Accel-Redirect and lets nginx fetch/serve them (see dramaflux.nginx)
+PROXY_SEGMENT_DELIVERY = os.environ.get('DRAMAFLUX_SEGMENT_DELIVERY', 'python')
+PROXY_ACCEL_UPSTREAM_LOCATION = '/_segment_upstream/'
+PROXY_ACCEL_CACHE_LOCATION = '/_segment_cache/'
+# Upstream hosts the segment proxy may fetch from ('.example.com' matches subdomains),
+# comma separated in DRAMAFLUX_ALLOWED_HOSTS. Enforced in 'accel' mode, where nginx
+# does the fetch - there an empty list allows nothing.
+PROXY_ALLOWED_HOSTS = [
+    h.strip() for h in os.environ.get('DRAMAFLUX_ALLOWED_HOSTS', '.nanodrama.com').split(',') if h.strip()
+]
+# Renditions handed out in master playlists (players can only tighten these
+# with ?max_height= / ?max_bandwidth=). None means no limit.
+PROXY_RENDITION_MAX_HEIGHT = None  # e.g. 720
+PROXY_RENDITION_MAX_BANDWIDTH = None  # bits/s, e.g. 3_000_000
+PROXY_RENDITION_ORDER = None  # 'asc' starts players on the lowest bitrate, 'desc' on the highest
+# Rewritten playlists point at /api/proxy/ts/<token> instead of ?url=<encoded upstream URL>
+# (dramas/proxy_tokens.py). The ?url= routes keep working either way.
+PROXY_COMPACT_URLS = True
+PROXY_TOKEN_TTL = 6 * 3600  # seconds a playlist's tokens stay resolvable
+PROXY_TOKEN_MAX_TABLES = 5000  # playlists kept in memory per worker
+# Token tables are shared through the database (ProxyTokenTable); expired rows
+# are deleted by whichever worker saves a table, at most this often
+PROXY_TOKEN_PURGE_INTERVAL = 300  # seconds
+
+# Rewritten m3u8 playlists (dramas/playlist_cache.py), cached until shortly
+# before the signed URL's token expires
+PLAYLIST_CACHE_ENABLED = True
+PLAYLIST_CACHE_MAX_ENTRIES = 2000  # per worker
+PLAYLIST_CACHE_MAX_TTL = 300  # seconds
+PLAYLIST_CACHE_DEFAULT_TTL = 30  # when the URL has no readable expiry
+PLAYLIST_CACHE_EXPIRY_MARGIN = 60  # stop serving this long before the token expires
+# Name of a CACHES alias to share playlists across workers (e.g. 'shared'), or None
+PLAYLIST_CACHE_ALIAS = None
+# Validity of Aliyun-style auth_key tokens, which only carry their issue time
+SIGNED_URL_AUTH_KEY_TTL = 1800
+
+# Stale-while-revalidate cache for JoliboxService.get_dramas/get_drama_detail
+# (the /api/dramas/ pass-through views), per worker
+JOLIBOX_SWR_ENABLED = True
+JOLIBOX_SWR_DRAMAS_SOFT_TTL = 300  # seconds before a background refresh
+JOLIBOX_SWR_DRAMAS_MAX_STALE = 6 * 3600  # older than this, callers wait for upstream again
+JOLIBOX_SWR_DRAMAS_MAX_STALE_ON_ERROR = 24 * 3600  # still served while upstream is failing
+JOLIBOX_SWR_DETAIL_SOFT_TTL = 60
+JOLIBOX_SWR_DETAIL_MAX_STALE = 900  # details carry signed play URLs, keep this short
+JOLIBOX_SWR_DETAIL_MAX_STALE_ON_ERROR = 900  # and never serve them past it, even on errors
+JOLIBOX_SWR_MAX_ENTRIES = 1000
+JOLIBOX_SWR_WORKERS = 2  # background refresh threads per cache
+
+# Play URLs handed out by /api/cached/.../play/ (dramas/play_urls.py): the stored
+# signed URL is reused until it's this close to expiring, then re-fetched
+PLAY_URL_CACHE_ENABLED = True
+PLAY_URL_EXPIRY_MARGIN = 300  # seconds
+PLAY_URL_UNKNOWN_TTL = 300  # seconds to reuse a URL whose expiry can't be read (not renewed ahead of time)
+PLAY_URL_BATCH_MAX = 10  # episodes per /episodes/play/ batch request
+PLAY_URL_BATCH_WORKERS = 4  # parallel upstream refreshes per batch request
+PLAY_TRACK_INTERVAL = 60  # seconds between last_played_at writes for one episode (per worker)
+# refresh_play_urls: renews the URLs of recently played episodes ahead of expiry
+PLAY_URL_HOT_WINDOW = 3600  # seconds since the last play for an episode to count as hot
+PLAY_URL_REFRESH_LEAD = 900  # renew URLs expiring within this many seconds
+PLAY_URL_REFRESH_INTERVAL = 60  # seconds between refresh rounds
+PLAY_URL_REFRESH_BUDGET = 30  # upstream detail calls per round at most
+
+# In-process catalog search (dramas/search.py); False falls back to name__icontains
+SEARCH_INDEX_ENABLED = True
+SEARCH_VERSION_CHECK_INTERVAL = 5  # seconds between catalog version checks per worker
+SEARCH_FUZZY_THRESHOLD = 0.4  # trigram similarity for a misspelled word to still match
+
+# Responses of the read-only cached-* views (dramas/response_cache.py), keyed on
+# CatalogState.version so a sync or admin save invalidates them all at once.
+# RESPONSE_CACHE_ALIAS may be 'default' (locmem, per worker) or a shared alias
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TTL = 600  # seconds, also bounds how stale view counts in cached lists get
+RESPONSE_CACHE_VERSION_CHECK_INTERVAL = 2  # seconds between catalog version reads per worker
+
+# Precompressed whole-catalog snapshot (dramas/snapshot.py), rebuilt at the end of each sync
+# and served by /api/cached/catalog/ with ETag revalidation
+SNAPSHOT_DIR = BASE_DIR / 'snapshot'
+SNAPSHOT_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+SNAPSHOT_VERSION_CHECK_INTERVAL = 2  # seconds between catalog version reads per worker
+
+# Plays counted into Drama.views (dramas/view_counter.py), flushed in batches per worker
+VIEW_COUNT_ENABLED = True
+VIEW_COUNT_FLUSH_INTERVAL = 10  # seconds
+
+# Disk cache for proxied segments (dramas/segment_cache.py), shared by all workers
+SEGMENT_CACHE_ENABLED = True
+SEGMENT_CACHE_DIR = BASE_DIR / 'segment_cache'
+SEGMENT_CACHE_MAX_BYTES = 5 * 1024 ** 3
+SEGMENT_CACHE_MAX_OBJECT_BYTES = 32 * 1024 ** 2
+# Each worker only counts its own fills, so it re-measures the shared directory this often
+SEGMENT_CACHE_RESCAN_INTERVAL = 30  # seconds
+# Query params that change per viewer/session and must not split the cache key
+SEGMENT_CACHE_VOLATILE_PARAMS = [
+    'auth_key', 'token', 'sign', 'signature', 'expires', 'expire', 'exp',
+    'policy', 'key-pair-id', 'hdnts', 'hdnea', 'wsSecret', 'wsTime', 't',
+]
+
+# In-memory cache for AES keys / init segments (dramas/object_cache.py), per worker
+OBJECT_CACHE_ENABLED = True
+OBJECT_CACHE_MAX_ENTRIES = 256
+OBJECT_CACHE_MAX_OBJECT_BYTES = 256 * 1024
+OBJECT_CACHE_TTL = 3600
+
+# Look-ahead prefetch of upcoming segments into the segment cache (dramas/prefetch.py)
+PREFETCH_ENABLED = False
+PREFETCH_SEGMENTS = 3  # segments warmed ahead of the player
+PREFETCH_WORKERS = 4  # per worker
+PREFETCH_MAX_QUEUE = 64
+PREFETCH_MAX_BYTES_PER_SEC = 20 * 1024 ** 2  # per worker
+
+# Proxy metrics (dramas/metrics.py): each worker dumps its counters to
+# METRICS_DIR/<pid>.json, /api/metrics/ merges them for Prometheus
+METRICS_ENABLED = True
+METRICS_DIR = BASE_DIR / 'metrics'
+METRICS_FLUSH_INTERVAL = 5  # seconds
+METRICS_STALE_AFTER = 60  # seconds without a flush before a worker's gauges are ignored
+METRICS_RETENTION = 7 * 86400  # seconds before a dead worker's file is removed
+
 ROOT_URLCONF = 'dramaflux.urls'
 
 TEMPLATES = [
@@ -109,6 +258,22 @@ DATABASES = {
 
 
 
+# Caches
+# 'default' is per worker; 'shared' is visible to every gunicorn/uvicorn worker
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -1,6 +1,32 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import JoliboxConfig, Drama, Episode, SyncLog
+from .models import JoliboxConfig, Category, Drama, Episode, SyncLog
+from .response_cache import bump_catalog_version
+
+
+class CatalogVersionAdminMixin:
+    """
+    Bump the catalog version after admin edits so cached API responses and
+    the catalog snapshot are rebuilt. Saves bump from save_related(), once
+    inlines and many-to-many fields are stored too, so nobody caches a
+    half-saved object under the new version. Only the bump happens in the
+    request; workers rebuild the snapshot in the background when they notice it.
+    """
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        self.catalog_changed()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.catalog_changed()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        self.catalog_changed()
+
+    def catalog_changed(self):
+        bump_catalog_version()
 
 
 @admin.register(JoliboxConfig)
@@ -30,11 +56,11 @@ class EpisodeInline(admin.TabularInline):
 
 
 @admin.register(Drama)
-class DramaAdmin(admin.ModelAdmin):
+class DramaAdmin(CatalogVersionAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'drama_id', 'episode_count', 'synced_episodes_display', 'views', 'is_active', 'last_synced')
     list_filter = ('is_active', 'orientation', 'status')
     search_fields = ('name', 'drama_id', 'description')
-    readonly_fields = ('drama_id', 'last_synced', 'created_at')
+    readonly_fields = ('drama_id', 'synced_episodes', 'last_synced', 'created_at')
     inlines = [EpisodeInline]
     
     fieldsets = (
@@ -48,23 +74,50 @@ class DramaAdmin(admin.ModelAdmin):
             'fields': ('episode_count', 'views', 'categories', 'status', 'host_mode', 'content_provider_id')
         }),
         ('Sync Info', {
-            'fields': ('last_synced', 'created_at'),
+            'fields': ('synced_episodes', 'last_synced', 'created_at'),
             'classes': ('collapse',)
         }),
     )
     
+    def save_related(self, request, form, formsets, change):
+        # `categories` is edited as JSON; keep its indexed copy in step like sync does
+        form.instance.sync_normalized_categories()
+        super().save_related(request, form, formsets, change)
+
+    def catalog_changed(self):
+        # Edited categories/is_active and deletions all move the per-category counts
+        Category.recount_dramas()
+        super().catalog_changed()
+
     @admin.display(description='Synced')
     def synced_episodes_display(self, obj):
-        total = obj.episodes.count()
-        unlocked = obj.episodes.filter(is_unlocked=True).count()
+        # Both denormalized on the row, so the changelist makes no query per drama
+        total = obj.episode_count
+        unlocked = obj.synced_episodes
         if total == 0:
             return "0/0"
         color = 'green' if unlocked == total else 'orange'
         return format_html('<span style="color: {};">{}/{}</span>', color, unlocked, total)
 
 
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    """Read-only: categories are derived from Drama.categories, edit those instead."""
+    list_display = ('name', 'active_drama_count')
+    search_fields = ('name',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Episode)
-class EpisodeAdmin(admin.ModelAdmin):
+class EpisodeAdmin(CatalogVersionAdminMixin, admin.ModelAdmin):
     list_display = ('drama', 'episode_number', 'is_unlocked', 'has_video_display', 'last_synced')
     list_filter = ('is_unlocked', 'drama')
     search_fields = ('drama__name', 'drama__drama_id')
@@ -0,0 +1,210 @@
+"""
+Async (ASGI) versions of the HLS proxy endpoints.
+
+Served when PROXY_MODE == 'async' (the default under dramaflux/asgi.py).
+Upstream bytes are relayed through an async generator, so every chunk is only
+read from the CDN once the ASGI server has accepted the previous one for the
+client (backpressure) and a single worker can carry hundreds of streams.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+
+from .proxy import (
+    PLAYLIST_CONTENT_TYPE, SMALL_OBJECT_KINDS,
+    accel_redirect_response, cached_segment_response, copy_segment_headers,
+    arewrite_playlist, prune_renditions, rendition_policy, small_object_response, start_segment_fill,
+    upstream_host_allowed, upstream_segment_headers,
+)
+from .metrics import observe_upstream
+from .object_cache import get_object_cache
+from .playlist_cache import get_playlist_cache
+from .prefetch import get_prefetcher
+from .proxy_tokens import aresolve_token
+from .segment_cache import get_segment_cache
+from .upstream import PLAYLIST_HEADERS, SEGMENT_HEADERS, CircuitOpenError, afetch_segment, get_async_session
+
+async def _relay(resp, writer=None):
+    """
+    Yield upstream chunks one at a time, releasing the connection at the end.
+    With a cache `writer` the chunks are also written to disk (in a worker
+    thread, off the event loop) and committed only if the whole body arrived.
+    """
+    completed = False
+    try:
+        async for chunk in resp.content.iter_chunked(settings.PROXY_CHUNK_SIZE):
+            if writer:
+                await asyncio.to_thread(writer.write, chunk)
+            yield chunk
+        completed = True
+    finally:
+        resp.release()
+        if writer:
+            await asyncio.to_thread(writer.commit if completed else writer.abort)
+
+
+async def _read_file(f):
+    """Yield a cached segment in chunks, each read in a worker thread; closes `f` at the end."""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(f.read, settings.PROXY_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+class AsyncProxyM3U8View(View):
+    """
+    Async proxy for M3U8 playlists to handle CORS and rewrites.
+    """
+
+    async def get(self, request, token=None):
+        if token:
+            target = await aresolve_token(token)
+            if target is None:
+                return JsonResponse({"error": "Unknown or expired proxy token"}, status=404)
+            target_url = target[0]
+        else:
+            target_url = request.GET.get('url')
+        if not target_url:
+            return JsonResponse({"error": "Missing url parameter"}, status=400)
+
+        try:
+            policy = rendition_policy(request.GET)
+            cache = get_playlist_cache()
+            if cache:
+                new_content = await cache.aget_or_fetch(
+                    target_url, lambda: self._fetch(target_url, policy), variant=policy.key if policy else ''
+                )
+            else:
+                new_content, _ = await self._fetch(target_url, policy)
+
+            # The prefetcher only queues work on its own thread pool, it doesn't block
+            prefetcher = get_prefetcher()
+            if prefetcher:
+                prefetcher.on_playlist(target_url)
+
+            return HttpResponse(
+                new_content,
+                content_type=PLAYLIST_CONTENT_TYPE,
+                headers={"Access-Control-Allow-Origin": "*"}
+            )
+
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+    @staticmethod
+    async def _fetch(target_url, policy=None):
+        """Fetch, prune and rewrite the playlist. Returns (rewritten_text, final_url)."""
+        started = time.monotonic()
+        try:
+            resp = await get_async_session().get(target_url, headers=PLAYLIST_HEADERS)
+        except Exception:
+            observe_upstream('playlist', 'error')
+            raise
+        observe_upstream('playlist', resp.status, time.monotonic() - started)
+        async with resp:
+            resp.raise_for_status()
+            content = await resp.text()
+            base_url = str(resp.url)
+        segments = []
+        new_content = await arewrite_playlist(prune_renditions(content, policy), base_url, segments)
+        prefetcher = get_prefetcher()
+        if prefetcher:
+            prefetcher.register(target_url, segments)
+        return new_content, base_url
+
+
+class AsyncProxyStreamView(View):
+    """
+    Async proxy for video segments (TS) or other binary content.
+    Shares the disk segment cache with the WSGI views. Cache hits are streamed
+    from disk chunk by chunk through worker threads (no sendfile under ASGI),
+    so neither the event loop nor memory holds a whole segment.
+    """
+
+    async def get(self, request, token=None):
+        if token:
+            target = await aresolve_token(token)
+            if target is None:
+                return JsonResponse({"error": "Unknown or expired proxy token"}, status=404)
+            target_url, kind = target
+        else:
+            target_url, kind = request.GET.get('url'), request.GET.get('kind')
+        if not target_url:
+            return JsonResponse({"error": "Missing url parameter"}, status=400)
+
+        if kind in SMALL_OBJECT_KINDS and not request.headers.get('Range'):
+            return await self._small_object(target_url)
+
+        prefetcher = get_prefetcher()
+        if prefetcher:
+            prefetcher.on_segment(target_url)
+
+        cache = get_segment_cache()
+        if settings.PROXY_SEGMENT_DELIVERY == 'accel':
+            if not upstream_host_allowed(target_url):
+                return JsonResponse({"error": "Upstream host not allowed"}, status=403)
+            return accel_redirect_response(target_url, cache)
+
+        if cache:
+            segment = await asyncio.to_thread(cache.lookup, target_url)
+            if segment:
+                response = await asyncio.to_thread(cached_segment_response, segment, request, _read_file)
+                if response:
+                    return response
+
+        resp = None
+        try:
+            resp = await afetch_segment(target_url, upstream_segment_headers(request))
+            if resp.status == 416:
+                resp.release()
+                response = HttpResponse(status=416)
+                copy_segment_headers(response, resp.headers)
+                response['Access-Control-Allow-Origin'] = '*'
+                return response
+            resp.raise_for_status()
+        except CircuitOpenError as e:
+            return JsonResponse(
+                {"error": str(e)}, status=503, headers={'Retry-After': str(settings.UPSTREAM_BREAKER_COOLDOWN)}
+            )
+        except Exception as e:
+            if resp is not None:
+                resp.release()
+            return JsonResponse({"error": str(e)}, status=500)
+
+        # Only complete objects go into the cache, never a 206 slice
+        writer = start_segment_fill(cache, target_url, resp.headers) if resp.status == 200 else None
+        response = StreamingHttpResponse(
+            _relay(resp, writer),
+            status=resp.status,
+            content_type=resp.headers.get('Content-Type', 'application/octet-stream')
+        )
+        copy_segment_headers(response, resp.headers)
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    @staticmethod
+    async def _small_object(target_url):
+        """AES keys and init segments: fetched whole and served from memory afterwards."""
+        cache = get_object_cache()
+        item = cache.get(target_url) if cache else None
+        if item:
+            return small_object_response(*item, cache_status='HIT')
+
+        try:
+            async with get_async_session().get(target_url, headers=SEGMENT_HEADERS) as resp:
+                resp.raise_for_status()
+                body = await resp.read()
+                content_type = resp.headers.get('Content-Type', 'application/octet-stream')
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+        if cache:
+            cache.put(target_url, body, content_type)
+        return small_object_response(body, content_type, cache_status='MISS')
@@ -0,0 +1,253 @@
+"""
+Small in-process caching primitives
+TTL cache, stale-while-revalidate cache and single-flight (request coalescing)
+helpers, thread and asyncio flavours.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Bounded, thread-safe LRU mapping whose entries expire after a per-key TTL."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, deadline = item
+            if deadline <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one.
+    The first caller runs `fn`; callers arriving while it runs wait and get
+    the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    """
+    asyncio version of SingleFlight.
+    The work runs in its own task, so a caller that goes away (client
+    disconnect) doesn't cancel it for everyone else waiting on the key.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, coro_fn):
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get(key)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(coro_fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away
+            task.exception()
+
+
+class StaleWhileRevalidate:
+    """
+    Cache that answers from memory and refreshes behind the caller.
+
+    Values younger than `soft_ttl` are served as is. Older ones, up to
+    `max_stale`, are still served immediately while a background thread
+    reloads them (one refresh per key at a time). Only a caller with no
+    usable value waits for the load, single-flighted per key. Results that
+    fail `is_valid` are never stored; when a load fails or returns one, the
+    last good value is served instead if it is younger than
+    `max_stale_on_error` (default `max_stale`). Entries past both ages are dropped.
+    """
+
+    def __init__(self, soft_ttl, max_stale, max_entries=1024, workers=2, is_valid=None, name='swr',
+                 max_stale_on_error=None):
+        self.soft_ttl = soft_ttl
+        self.max_stale = max_stale
+        self.max_stale_on_error = max_stale if max_stale_on_error is None else max_stale_on_error
+        self.max_entries = max_entries
+        self.workers = workers
+        self.is_valid = is_valid or (lambda value: True)
+        self.name = name
+
+        self._data = OrderedDict()  # key -> (value, stored_at)
+        self._refreshing = set()
+        self._flight = SingleFlight()
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.stale_on_error = 0
+
+    def get(self, key, loader):
+        with self._lock:
+            entry = self._data.get(key)
+            age = time.monotonic() - entry[1] if entry is not None else None
+            if age is not None and age >= max(self.max_stale, self.max_stale_on_error):
+                del self._data[key]
+                entry = age = None
+            if entry is not None:
+                self._data.move_to_end(key)
+            if age is not None and age < self.soft_ttl:
+                self.fresh_hits += 1
+                return entry[0]
+            serve_stale = age is not None and age < self.max_stale
+            if serve_stale:
+                self.stale_hits += 1
+                refresh = key not in self._refreshing
+                self._refreshing.add(key)
+            else:
+                self.misses += 1
+
+        if serve_stale:
+            if refresh:
+                self._submit(key, loader)
+            return entry[0]
+
+        # Nothing usable: load now, falling back to the old value if that fails
+        fallback = entry is not None and age < self.max_stale_on_error
+        try:
+            value, valid = self._flight.do(key, lambda: self._load(key, loader))
+        except Exception:
+            if not fallback:
+                raise
+            valid = False
+        if not valid and fallback:
+            with self._lock:
+                self.stale_on_error += 1
+            return entry[0]
+        return value
+
+    def _load(self, key, loader):
+        value = loader()
+        valid = self.is_valid(value)
+        if valid:
+            with self._lock:
+                self._data[key] = (value, time.monotonic())
+                self._data.move_to_end(key)
+                while len(self._data) > self.max_entries:
+                    self._data.popitem(last=False)
+        return value, valid
+
+    def _submit(self, key, loader):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        try:
+            self._executor.submit(self._refresh, key, loader)
+        except RuntimeError:
+            # Interpreter shutting down, the stale value stays until next time
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh(self, key, loader):
+        try:
+            _, valid = self._flight.do(key, lambda: self._load(key, loader))
+        except Exception as e:
+            logger.warning(f"Background refresh of {self.name} {key!r} failed: {e}")
+            valid = False
+        with self._lock:
+            self._refreshing.discard(key)
+            if valid:
+                self.refreshes += 1
+            else:
+                self.refresh_failures += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "freshHits": self.fresh_hits,
+                "staleHits": self.stale_hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "refreshFailures": self.refresh_failures,
+                "staleOnError": self.stale_on_error,
+            }
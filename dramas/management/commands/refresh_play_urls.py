@@ -0,0 +1,85 @@
+"""
+Django management command that keeps the play URLs of hot episodes fresh.
+Episodes played within PLAY_URL_HOT_WINDOW get their signed video_url renewed
+through the detail endpoint before it expires, so play requests for them
+never have to wait on upstream. URLs whose expiry can't be read are left to
+play requests (see PlayUrlResolver.due_for_renewal).
+
+Usage:
+    python manage.py refresh_play_urls          # long-lived worker
+    python manage.py refresh_play_urls --once   # single round (e.g. from cron)
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from dramas.models import Episode
+from dramas.play_urls import get_play_url_resolver
+
+logger = logging.getLogger(__name__)
+
+# Hot episodes looked at per round, most recently played first
+MAX_CANDIDATES = 5000
+
+
+class Command(BaseCommand):
+    help = 'Renew play URLs of recently played episodes before their token expires'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single round and exit')
+        parser.add_argument('--interval', type=float, default=settings.PLAY_URL_REFRESH_INTERVAL,
+                            help='Seconds between rounds')
+        parser.add_argument('--budget', type=int, default=settings.PLAY_URL_REFRESH_BUDGET,
+                            help='Upstream detail calls per round at most')
+        parser.add_argument('--lead', type=float, default=settings.PLAY_URL_REFRESH_LEAD,
+                            help='Renew URLs expiring within this many seconds')
+
+    def handle(self, *args, **options):
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s [%(levelname)s] %(message)s'
+        )
+
+        self.stdout.write(self.style.NOTICE('Starting play URL refresher...'))
+        while True:
+            started = time.monotonic()
+            # Drop a connection broken by a database restart/idle timeout, else every round fails
+            close_old_connections()
+            try:
+                refreshed, due = self.refresh_round(options['budget'], options['lead'])
+                if due:
+                    logger.info(f"Refreshed {refreshed}/{due} expiring play URLs")
+            except Exception as e:
+                logger.error(f"Refresh round failed: {e}")
+            if options['once']:
+                break
+            time.sleep(max(options['interval'] - (time.monotonic() - started), 0))
+
+    @staticmethod
+    def refresh_round(budget, lead):
+        """Renew the soonest-expiring hot URLs, at most `budget` of them. Returns (refreshed, due)."""
+        resolver = get_play_url_resolver()
+        hot_since = timezone.now() - timedelta(seconds=settings.PLAY_URL_HOT_WINDOW)
+        candidates = (
+            Episode.objects
+            .filter(is_unlocked=True, last_played_at__gte=hot_since)
+            .select_related('drama')
+            .order_by('-last_played_at')[:MAX_CANDIDATES]
+        )
+        due = [e for e in candidates if resolver.due_for_renewal(e, lead)]
+        due.sort(key=lambda e: resolver.deadline(e) or 0)
+
+        refreshed = 0
+        for episode in due[:budget]:
+            try:
+                before = episode.video_url
+                if resolver.refresh(episode, lead) != before:
+                    refreshed += 1
+            except Exception as e:
+                logger.warning(f"Failed to refresh {episode}: {e}")
+        return refreshed, len(due)
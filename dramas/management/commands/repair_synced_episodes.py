@@ -0,0 +1,38 @@
+"""
+Django management command that checks Drama.synced_episodes against the
+actual number of unlocked episodes and fixes any drift (e.g. after episodes
+were edited or deleted outside the sync service).
+
+Usage:
+    python manage.py repair_synced_episodes
+    python manage.py repair_synced_episodes --dry-run
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Q
+
+from dramas.models import Drama
+
+
+class Command(BaseCommand):
+    help = 'Recount Drama.synced_episodes where it differs from the unlocked episodes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report mismatches')
+
+    def handle(self, *args, **options):
+        drifted = list(
+            Drama.objects
+            .annotate(actual=Count('episodes', filter=Q(episodes__is_unlocked=True)))
+            .exclude(synced_episodes=F('actual'))
+            .values_list('pk', 'drama_id', 'synced_episodes', 'actual')
+        )
+        for _, drama_id, stored, actual in drifted:
+            self.stdout.write(f'{drama_id}: stored {stored}, actual {actual}')
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All synced episode counts are consistent.'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} dramas out of sync (dry run, nothing changed).'))
+        else:
+            Drama.recount_synced_episodes([pk for pk, *_ in drifted])
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(drifted)} dramas.'))
@@ -0,0 +1,323 @@
+"""
+Proxy metrics.
+
+Counters, gauges and histograms are kept per worker in plain dicts (one lock,
+no I/O on the hot path) and a background thread dumps them every
+METRICS_FLUSH_INTERVAL seconds to METRICS_DIR/<pid>.json. /api/metrics/ merges the files of all workers into
+the Prometheus text format.
+
+proxy_metrics_middleware records request counts, response bytes, durations and
+active streams for the proxy endpoints; upstream.py and the playlist views
+record upstream time to first byte and status codes.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+# Seconds; covers a key served from memory up to a slow 10 s segment relay
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# url names of the proxy routes -> endpoint label
+PROXY_ENDPOINTS = {
+    'proxy-m3u8': 'm3u8',
+    'proxy-m3u8-token': 'm3u8',
+    'proxy-ts': 'ts',
+    'proxy-ts-token': 'ts',
+}
+
+HELP = {
+    'dramaflux_proxy_requests_total': ('counter', 'Proxy requests by endpoint, status and source'),
+    'dramaflux_proxy_response_bytes_total': ('counter', 'Bytes sent to clients by the proxy'),
+    'dramaflux_proxy_request_duration_seconds': ('histogram', 'Time from request to last byte sent'),
+    'dramaflux_proxy_active_streams': ('gauge', 'Responses currently being streamed'),
+    'dramaflux_upstream_ttfb_seconds': ('histogram', 'Upstream time to first byte (response headers)'),
+    'dramaflux_upstream_responses_total': ('counter', 'Upstream responses by kind and status'),
+}
+
+
+class Registry:
+    """One worker's metrics, flushed to its own file in METRICS_DIR."""
+
+    def __init__(self, directory, flush_interval):
+        self.directory = str(directory)
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.path = os.path.join(self.directory, f"{self.pid}.json")
+        self.counters = {}
+        self.gauges = {}
+        # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge_add(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            buckets = self.histograms.get(key)
+            if buckets is None:
+                buckets = self.histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+                    break
+            else:
+                buckets[-2] += 1
+            buckets[-1] += value
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                snapshot = {
+                    'counters': [[n, l, v] for (n, l), v in self.counters.items()],
+                    'gauges': [[n, l, v] for (n, l), v in self.gauges.items()],
+                    'histograms': [[n, l, list(b)] for (n, l), b in self.histograms.items()],
+                }
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp, self.path)
+            except OSError:
+                pass
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Get this worker's registry, or None when metrics are disabled."""
+    global _registry
+    if not settings.METRICS_ENABLED:
+        return None
+    if _registry is None or _registry.pid != os.getpid():
+        # (re)created after a fork so every worker writes its own file (and has a flusher thread)
+        with _registry_lock:
+            if _registry is None or _registry.pid != os.getpid():
+                _registry = Registry(settings.METRICS_DIR, settings.METRICS_FLUSH_INTERVAL)
+                atexit.register(_registry.close)
+    return _registry
+
+
+def observe_upstream(kind: str, status, ttfb=None):
+    """Record one upstream response (status may be 'error') and its time to first byte."""
+    registry = get_registry()
+    if registry is None:
+        return
+    registry.inc('dramaflux_upstream_responses_total', kind=kind, status=str(status))
+    if ttfb is not None:
+        registry.observe('dramaflux_upstream_ttfb_seconds', ttfb, kind=kind)
+
+
+# ----------------------------------------------------------------------
+# Request instrumentation
+# ----------------------------------------------------------------------
+
+def _source(response):
+    if response.has_header('X-Accel-Redirect'):
+        return 'accel'
+    return 'cache' if response.get('X-Cache') == 'HIT' else 'upstream'
+
+
+class _Stream:
+    """Book-keeping for one response until its last byte is sent."""
+
+    def __init__(self, registry, endpoint, source, started):
+        self.registry = registry
+        self.labels = {'endpoint': endpoint, 'source': source}
+        self.started = started
+        self.sent = 0
+
+    def open(self):
+        self.registry.gauge_add('dramaflux_proxy_active_streams', 1, endpoint=self.labels['endpoint'])
+
+    def close(self):
+        self.registry.gauge_add('dramaflux_proxy_active_streams', -1, endpoint=self.labels['endpoint'])
+        self.finish()
+
+    def finish(self):
+        self.registry.inc('dramaflux_proxy_response_bytes_total', self.sent, **self.labels)
+        self.registry.observe(
+            'dramaflux_proxy_request_duration_seconds', time.monotonic() - self.started, **self.labels
+        )
+
+    def relay(self, chunks):
+        self.open()
+        try:
+            for chunk in chunks:
+                self.sent += len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+    async def arelay(self, chunks):
+        self.open()
+        try:
+            async for chunk in chunks:
+                self.sent += len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+
+def _instrument(request, response, started):
+    registry = get_registry()
+    match = getattr(request, 'resolver_match', None)
+    endpoint = PROXY_ENDPOINTS.get(match.url_name) if match else None
+    if registry is None or endpoint is None:
+        return response
+
+    source = _source(response)
+    registry.inc(
+        'dramaflux_proxy_requests_total', endpoint=endpoint, status=str(response.status_code), source=source
+    )
+    stream = _Stream(registry, endpoint, source, started)
+
+    if getattr(response, 'file_to_stream', None) is not None:
+        # Left as is so the server can still sendfile() it; the size is known upfront
+        stream.sent = int(response.get('Content-Length') or 0)
+        stream.finish()
+    elif response.streaming:
+        if response.is_async:
+            response.streaming_content = stream.arelay(response.streaming_content)
+        else:
+            response.streaming_content = stream.relay(response.streaming_content)
+    else:
+        stream.sent = len(response.content)
+        stream.finish()
+    return response
+
+
+@sync_and_async_middleware
+def proxy_metrics_middleware(get_response):
+    """Counts, bytes, durations and active streams for the proxy endpoints."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.monotonic()
+            response = await get_response(request)
+            return _instrument(request, response, started)
+    else:
+        def middleware(request):
+            started = time.monotonic()
+            response = get_response(request)
+            return _instrument(request, response, started)
+    return middleware
+
+
+# ----------------------------------------------------------------------
+# Aggregation across workers
+# ----------------------------------------------------------------------
+
+def _read_snapshots(directory, stale_after, retention):
+    """
+    Yield (snapshot, live) for every worker file. Files of workers that stopped
+    updating still contribute counters (so totals don't go backwards on worker
+    restarts) but not gauges, and are removed after `retention` seconds.
+    """
+    try:
+        names = [n for n in os.listdir(directory) if n.endswith('.json')]
+    except FileNotFoundError:
+        return
+    now = time.time()
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            age = now - os.stat(path).st_mtime
+            if age > retention:
+                os.unlink(path)
+                continue
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        yield snapshot, age <= stale_after
+
+
+def collect() -> dict:
+    """Merge the metrics of all workers: counters and histograms summed, gauges of live workers summed."""
+    registry = get_registry()
+    if registry:
+        registry.flush()
+
+    merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for snapshot, live in _read_snapshots(
+        str(settings.METRICS_DIR), settings.METRICS_STALE_AFTER, settings.METRICS_RETENTION
+    ):
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            merged['counters'][key] = merged['counters'].get(key, 0) + value
+        for name, labels, buckets in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = merged['histograms'].setdefault(key, [0] * len(buckets))
+            merged['histograms'][key] = [a + b for a, b in zip(total, buckets)]
+        if live:
+            for name, labels, value in snapshot['gauges']:
+                key = (name, tuple(map(tuple, labels)))
+                merged['gauges'][key] = merged['gauges'].get(key, 0) + value
+    return merged
+
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+def render_prometheus(merged: dict) -> str:
+    """Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for name, (kind, help_text) in HELP.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'histogram':
+            for (metric, labels), buckets in sorted(merged['histograms'].items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS, buckets):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+                cumulative += buckets[-2]
+                lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {buckets[-1]}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        else:
+            values = merged['counters'] if kind == 'counter' else merged['gauges']
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
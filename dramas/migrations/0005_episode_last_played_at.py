@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dramas', '0004_drama_synclog_episode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='episode',
+            name='last_played_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
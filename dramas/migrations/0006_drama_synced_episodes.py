@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_synced_episodes(apps, schema_editor):
+    Drama = apps.get_model('dramas', 'Drama')
+    Episode = apps.get_model('dramas', 'Episode')
+    unlocked = (
+        Episode.objects.filter(drama=OuterRef('pk'), is_unlocked=True)
+        .values('drama').annotate(n=Count('pk')).values('n')
+    )
+    Drama.objects.update(synced_episodes=Coalesce(Subquery(unlocked), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dramas', '0005_episode_last_played_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drama',
+            name='synced_episodes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_synced_episodes, migrations.RunPython.noop),
+    ]
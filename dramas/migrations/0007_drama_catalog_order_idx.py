@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dramas', '0006_drama_synced_episodes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drama',
+            index=models.Index(fields=['-views', 'name', 'id'], name='drama_catalog_order_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_categories(apps, schema_editor):
+    Drama = apps.get_model('dramas', 'Drama')
+    Category = apps.get_model('dramas', 'Category')
+    Through = Drama.normalized_categories.through
+
+    dramas = list(Drama.objects.values_list('pk', 'categories'))
+    names = {str(c) for _, categories in dramas for c in (categories or [])}
+    Category.objects.bulk_create([Category(name=n) for n in names], ignore_conflicts=True)
+    category_ids = dict(Category.objects.values_list('name', 'pk'))
+    Through.objects.bulk_create(
+        [
+            Through(drama_id=pk, category_id=category_ids[name])
+            for pk, categories in dramas
+            for name in {str(c) for c in (categories or [])}
+        ],
+        ignore_conflicts=True,
+    )
+
+    active = (
+        Through.objects.filter(category=OuterRef('pk'), drama__is_active=True)
+        .values('category').annotate(n=Count('pk')).values('n')
+    )
+    Category.objects.update(active_drama_count=Coalesce(Subquery(active), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dramas', '0008_catalogstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('active_drama_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Category',
+                'verbose_name_plural': 'Categories',
+                'ordering': ['-active_drama_count', 'name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='drama',
+            name='normalized_categories',
+            field=models.ManyToManyField(blank=True, related_name='dramas', to='dramas.category'),
+        ),
+        migrations.RunPython(backfill_categories, migrations.RunPython.noop),
+    ]
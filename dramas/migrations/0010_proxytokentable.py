@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dramas', '0009_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProxyTokenTable',
+            fields=[
+                ('tid', models.CharField(max_length=16, primary_key=True, serialize=False)),
+                ('targets', models.JSONField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Proxy Token Table',
+                'verbose_name_plural': 'Proxy Token Tables',
+            },
+        ),
+    ]
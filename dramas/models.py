@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 
 class JoliboxConfig(models.Model):
@@ -28,6 +31,56 @@ class JoliboxConfig(models.Model):
         return config
 
 
+class CatalogState(models.Model):
+    """Singleton version stamp of the cached catalog, bumped whenever sync changes it."""
+
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Catalog State"
+        verbose_name_plural = "Catalog State"
+
+    def __str__(self):
+        return f"Catalog v{self.version}"
+
+    @classmethod
+    def current_version(cls) -> int:
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls):
+        """Move the catalog to a new version (one UPDATE)."""
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1, updated_at=timezone.now()):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+class Category(models.Model):
+    """Drama category, normalized out of Drama.categories by sync."""
+
+    name = models.CharField(max_length=100, unique=True)
+    # Active dramas in the category, recomputed by sync; see recount_dramas()
+    active_drama_count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Category"
+        verbose_name_plural = "Categories"
+        ordering = ['-active_drama_count', 'name']
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def recount_dramas(cls):
+        """Recompute every category's active_drama_count in one UPDATE."""
+        active = (
+            Drama.normalized_categories.through.objects
+            .filter(category=OuterRef('pk'), drama__is_active=True)
+            .values('category').annotate(n=Count('pk')).values('n')
+        )
+        return cls.objects.update(active_drama_count=Coalesce(Subquery(active), 0))
+
+
 class Drama(models.Model):
     """Cached drama from NanoDrama API."""
     
@@ -39,7 +92,11 @@ class Drama(models.Model):
     episode_count = models.IntegerField(default=0)
     orientation = models.CharField(max_length=20, default="VERTICAL")
     categories = models.JSONField(default=list, blank=True)
+    # Indexed copy of `categories`, kept in step by sync and DramaAdmin
+    normalized_categories = models.ManyToManyField(Category, related_name='dramas', blank=True)
     views = models.IntegerField(default=0)
+    # Unlocked episodes, denormalized from Episode; see recount_synced_episodes()
+    synced_episodes = models.IntegerField(default=0)
     status = models.CharField(max_length=50, default="PUBLISHED")
     host_mode = models.CharField(max_length=50, default="JOLIBOX_HOST")
     content_provider_id = models.CharField(max_length=100, blank=True, default="")
@@ -51,10 +108,30 @@ class Drama(models.Model):
         verbose_name = "Drama"
         verbose_name_plural = "Dramas"
         ordering = ['-views', 'name']
+        indexes = [
+            # Catalog order, used by keyset pagination (dramas/pagination.py)
+            models.Index(fields=['-views', 'name', 'id'], name='drama_catalog_order_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.drama_id})"
 
+    def sync_normalized_categories(self):
+        """Point normalized_categories at the Category rows named in `categories`, creating missing ones."""
+        names = {str(c) for c in self.categories or []}
+        Category.objects.bulk_create([Category(name=n) for n in names], ignore_conflicts=True)
+        self.normalized_categories.set(Category.objects.filter(name__in=names))
+
+    @classmethod
+    def recount_synced_episodes(cls, pks=None):
+        """Recompute synced_episodes in one UPDATE, for the given drama pks or all dramas."""
+        unlocked = (
+            Episode.objects.filter(drama=OuterRef('pk'), is_unlocked=True)
+            .values('drama').annotate(n=Count('pk')).values('n')
+        )
+        queryset = cls.objects.all() if pks is None else cls.objects.filter(pk__in=pks)
+        return queryset.update(synced_episodes=Coalesce(Subquery(unlocked), 0))
+
 
 class Episode(models.Model):
     """Cached episode with video URL from NanoDrama API."""
@@ -64,6 +141,8 @@ class Episode(models.Model):
     video_url = models.URLField(max_length=2000, blank=True, default="")
     is_unlocked = models.BooleanField(default=False)
     unlock_error = models.TextField(blank=True, default="")
+    # Set (throttled) when the episode is played; drives refresh_play_urls
+    last_played_at = models.DateTimeField(null=True, blank=True, db_index=True)
     last_synced = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -106,3 +185,18 @@ class SyncLog(models.Model):
 
     def __str__(self):
         return f"{self.sync_type} - {self.status} ({self.started_at})"
+
+
+class ProxyTokenTable(models.Model):
+    """Upstream URLs behind one rewritten playlist's compact proxy tokens (see proxy_tokens.py)."""
+
+    tid = models.CharField(max_length=16, primary_key=True)
+    targets = models.JSONField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Proxy Token Table"
+        verbose_name_plural = "Proxy Token Tables"
+
+    def __str__(self):
+        return self.tid
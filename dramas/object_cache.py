@@ -0,0 +1,71 @@
+"""
+In-memory cache for AES keys and init segments.
+
+Both are a few bytes to a few KB and are requested once per segment by every
+viewer of an episode, so they're kept in process memory (per worker) rather
+than going to the disk segment cache or upstream each time.
+"""
+import threading
+from typing import Optional
+
+from django.conf import settings
+
+from .caching import TTLCache
+from .segment_cache import segment_key
+
+
+class ObjectCache:
+    """Bounded TTL cache of small upstream objects, keyed on the token-less URL."""
+
+    def __init__(self, max_entries, max_object_bytes, ttl):
+        self.entries = TTLCache(max_entries)
+        self.max_object_bytes = max_object_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str) -> Optional[tuple]:
+        """Return (body, content_type) or None."""
+        item = self.entries.get(segment_key(url))
+        with self._lock:
+            if item is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return item
+
+    def put(self, url: str, body: bytes, content_type: str):
+        if len(body) <= self.max_object_bytes:
+            self.entries.set(segment_key(url), (body, content_type), self.ttl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self.entries),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_object_cache() -> Optional[ObjectCache]:
+    """Get the process-wide key/init cache, or None when it's disabled."""
+    global _cache
+    if not settings.OBJECT_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ObjectCache(
+                    max_entries=settings.OBJECT_CACHE_MAX_ENTRIES,
+                    max_object_bytes=settings.OBJECT_CACHE_MAX_OBJECT_BYTES,
+                    ttl=settings.OBJECT_CACHE_TTL,
+                )
+    return _cache
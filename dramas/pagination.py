@@ -0,0 +1,84 @@
+"""
+Keyset (cursor) pagination for the cached drama list.
+
+Pages are ordered on (-views, name, id) and a cursor is the opaque position
+of the last row of the previous page, so fetching any page costs the same
+index range scan (drama_catalog_order_idx) and rows don't shift between pages
+the way OFFSET does when view counts change. Rows are values() dicts holding
+at least id, views and name.
+"""
+import base64
+import json
+
+from django.db.models import Q
+
+from .caching import TTLCache
+
+CATALOG_ORDER = ('-views', 'name', 'id')
+
+# Totals are only an estimate in cursor mode, recounted at most this often per filter
+APPROX_COUNT_TTL = 60
+_counts = TTLCache(256)
+
+
+def encode_cursor(row) -> str:
+    raw = json.dumps([row['views'], row['name'], row['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """Return (views, name, id); raises ValueError for anything we didn't issue."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        views, name, pk = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not (isinstance(views, int) and isinstance(name, str) and isinstance(pk, int)):
+        raise ValueError("Invalid cursor")
+    return views, name, pk
+
+
+def keyset_page(queryset, cursor, limit):
+    """One page of `queryset` after `cursor` (None for the first page). Returns (rows, next_cursor)."""
+    queryset = queryset.order_by(*CATALOG_ORDER)
+    if cursor:
+        views, name, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(views__lt=views)
+            | Q(views=views, name__gt=name)
+            | Q(views=views, name=name, id__gt=pk)
+        )
+    rows = list(queryset[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def encode_offset_cursor(offset: int) -> str:
+    """Cursor for result lists that are ranked in memory (search) rather than keyset-ordered."""
+    return base64.urlsafe_b64encode(json.dumps({'o': offset}).encode()).decode().rstrip('=')
+
+
+def decode_offset_cursor(cursor: str) -> int:
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))['o']
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
+
+
+def ranked_page(queryset, ranked_pks, start, limit) -> list:
+    """Rows of `queryset` for ranked_pks[start:start + limit], in rank order (one query)."""
+    page = ranked_pks[start:start + limit]
+    rows = {row['id']: row for row in queryset.filter(pk__in=page)}
+    return [rows[pk] for pk in page if pk in rows]
+
+
+def approximate_count(queryset, key) -> int:
+    """count() of `queryset`, reused for APPROX_COUNT_TTL seconds per `key`."""
+    total = _counts.get(key)
+    if total is None:
+        total = queryset.count()
+        _counts.set(key, total, APPROX_COUNT_TTL)
+    return total
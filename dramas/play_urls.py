@@ -0,0 +1,201 @@
+"""
+Play URL resolution for CachedEpisodePlayView.
+
+The stored Episode.video_url is a signed m3u8 URL. It is served as long as
+its token is valid for at least PLAY_URL_EXPIRY_MARGIN more seconds and only
+re-fetched from upstream (get_drama_detail) once it's about to expire.
+Concurrent refreshes of one episode within a worker collapse into a single
+upstream call; other workers pick the new URL up from the database.
+
+Plays are recorded in Episode.last_played_at (at most once per
+PLAY_TRACK_INTERVAL per episode and worker) so the refresh_play_urls command
+can renew hot episodes before their token runs out.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .caching import SingleFlight, TTLCache
+from .proxy import url_expiry
+from .models import Episode
+from .services import JoliboxService
+
+logger = logging.getLogger(__name__)
+
+
+class PlayUrlResolver:
+    """Serves stored play URLs until they expire, refreshing each episode at most once at a time."""
+
+    def __init__(self, expiry_margin, unknown_ttl, track_interval):
+        self.expiry_margin = expiry_margin
+        self.unknown_ttl = unknown_ttl
+        self.track_interval = track_interval
+        self.flight = SingleFlight()
+        # Episodes whose play was recorded recently, to throttle last_played_at writes
+        self.recently_played = TTLCache(10000)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def deadline(self, episode):
+        """Unix time the stored URL stops working, or None if there's nothing usable stored."""
+        if not episode.video_url:
+            return None
+        expiry = url_expiry(episode.video_url)
+        if expiry is not None:
+            return expiry
+        # No readable token expiry: trust it for a short while after it was stored
+        if not episode.last_synced:
+            return None
+        return (episode.last_synced + timedelta(seconds=self.unknown_ttl)).timestamp()
+
+    def is_fresh(self, episode, margin=None) -> bool:
+        """
+        Whether the stored URL is still valid for at least `margin` (default
+        PLAY_URL_EXPIRY_MARGIN) seconds. A URL without a readable expiry is
+        reused for PLAY_URL_UNKNOWN_TTL after it was stored; no margin applies
+        to that window, it isn't a real expiry.
+        """
+        if not settings.PLAY_URL_CACHE_ENABLED:
+            return False
+        deadline = self.deadline(episode)
+        if deadline is not None and url_expiry(episode.video_url) is None:
+            return time.time() < deadline
+        margin = self.expiry_margin if margin is None else margin
+        return deadline is not None and deadline - time.time() > margin
+
+    def due_for_renewal(self, episode, lead) -> bool:
+        """
+        Whether refresh_play_urls should renew the stored URL ahead of time,
+        i.e. it expires within `lead` seconds. URLs without a readable expiry
+        are left to play requests: renewing early would only fetch another
+        URL of unknown expiry, every round.
+        """
+        if episode.video_url and url_expiry(episode.video_url) is None:
+            return False
+        return not self.is_fresh(episode, lead)
+
+    def mark_played(self, episodes):
+        """Record a play in last_played_at, at most once per track interval per episode."""
+        due = []
+        for episode in episodes:
+            key = (episode.drama_id, episode.episode_number)
+            if not self.recently_played.get(key):
+                self.recently_played.set(key, True, self.track_interval)
+                due.append(episode)
+        if not due:
+            return
+        now = timezone.now()
+        Episode.objects.filter(pk__in=[e.pk for e in due]).update(last_played_at=now)
+        for episode in due:
+            episode.last_played_at = now
+
+    def resolve(self, episode) -> str:
+        """Return a playable URL for `episode`, refreshing it from upstream if needed."""
+        self.resolve_many([episode])
+        return episode.video_url
+
+    def resolve_many(self, episodes):
+        """
+        resolve() for several episodes: one last_played_at update, and the
+        stale ones refreshed in parallel on up to PLAY_URL_BATCH_WORKERS threads.
+        Each episode's video_url is updated in place.
+        """
+        self.mark_played(episodes)
+        stale = [e for e in episodes if not self.is_fresh(e)]
+        with self._lock:
+            self.hits += len(episodes) - len(stale)
+            self.misses += len(stale)
+
+        if len(stale) == 1:
+            self._refresh_or_keep(stale[0])
+        elif stale:
+            workers = min(len(stale), settings.PLAY_URL_BATCH_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='play-url') as pool:
+                list(pool.map(self._refresh_in_thread, stale))
+
+    def _refresh_or_keep(self, episode):
+        try:
+            self.refresh(episode)
+        except Exception as e:
+            # Fall back to the stored URL, it might still work if recent
+            logger.warning(f"Failed to refresh video URL for {episode}: {e}")
+            with self._lock:
+                self.errors += 1
+
+    def _refresh_in_thread(self, episode):
+        try:
+            self._refresh_or_keep(episode)
+        finally:
+            # Django opened a connection for this pool thread
+            connection.close()
+
+    def refresh(self, episode, margin=None) -> str:
+        """
+        Fetch a new URL from upstream unless the stored one is valid for
+        `margin` more seconds. Concurrent calls for one episode share a single fetch.
+        """
+        key = (episode.drama_id, episode.episode_number)
+        episode.video_url = self.flight.do(key, lambda: self._refresh(episode, margin))
+        return episode.video_url
+
+    def _refresh(self, episode, margin) -> str:
+        # Another worker may have refreshed it since we loaded the row
+        episode.refresh_from_db(fields=['video_url', 'last_synced'])
+        if self.is_fresh(episode, margin):
+            return episode.video_url
+
+        # fresh: a cached detail could hold the very URL we're replacing
+        detail = JoliboxService().get_drama_detail(
+            episode.drama.drama_id, episode_num=episode.episode_number, fresh=True
+        )
+        if detail.get('code') != 'SUCCESS':
+            raise RuntimeError(detail.get('message') or 'upstream error')
+        fresh_video_url = ((detail.get('data') or {}).get('playInfo') or {}).get('episodeM3u8')
+        if not fresh_video_url:
+            # Unlikely if unlocked; keep serving the stored URL
+            return episode.video_url
+
+        episode.video_url = fresh_video_url
+        episode.save(update_fields=['video_url', 'last_synced'])
+        with self._lock:
+            self.refreshes += 1
+        return fresh_video_url
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "upstreamRefreshes": self.refreshes,
+                "errors": self.errors,
+            }
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_play_url_resolver() -> PlayUrlResolver:
+    """Get the process-wide play URL resolver."""
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = PlayUrlResolver(
+                    expiry_margin=settings.PLAY_URL_EXPIRY_MARGIN,
+                    unknown_ttl=settings.PLAY_URL_UNKNOWN_TTL,
+                    track_interval=settings.PLAY_TRACK_INTERVAL,
+                )
+    return _resolver
@@ -0,0 +1,218 @@
+"""
+Cache for rewritten m3u8 playlists.
+
+The rewritten text is kept in-process and, when PLAYLIST_CACHE_ALIAS names a
+Django cache, in that shared cache as well so every worker benefits from one
+fetch. Entries live until shortly before the signed URL's token expires.
+Concurrent misses for the same playlist collapse into a single upstream
+fetch: within a process via single-flight, across workers via a lock key in
+the shared cache.
+"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .caching import AsyncSingleFlight, SingleFlight, TTLCache
+from .proxy import url_expiry
+
+TARGET_DURATION_RE = re.compile(r'^#EXT-X-TARGETDURATION:(\d+)', re.MULTILINE)
+
+# How often a worker that lost the shared fill lock checks for the winner's result
+LOCK_POLL_INTERVAL = 0.05
+
+
+class PlaylistCache:
+    """TTL store of rewritten playlist text with per-key request coalescing."""
+
+    def __init__(self, max_entries, max_ttl, default_ttl, expiry_margin, alias=None):
+        self.local = TTLCache(max_entries)
+        self.max_ttl = max_ttl
+        self.default_ttl = default_ttl
+        self.expiry_margin = expiry_margin
+        self.alias = alias
+        self.flight = SingleFlight()
+        self.aflight = AsyncSingleFlight()
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    def ttl_for(self, text: str, *urls) -> float:
+        """Seconds the rewritten playlist may be served for."""
+        expiries = [e for e in map(url_expiry, urls) if e]
+        if expiries:
+            ttl = min(expiries) - time.time() - self.expiry_margin
+        else:
+            ttl = self.default_ttl
+        ttl = min(ttl, self.max_ttl)
+
+        # Live media playlists change every target duration
+        if '#EXTINF' in text and '#EXT-X-ENDLIST' not in text:
+            match = TARGET_DURATION_RE.search(text)
+            ttl = min(ttl, int(match.group(1)) / 2 if match else 1)
+        return ttl
+
+    @staticmethod
+    def _shared_key(key):
+        return f"playlist:{hashlib.sha1(key.encode()).hexdigest()}"
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _from_shared(self, key, entry) -> Optional[str]:
+        """Promote a shared-cache entry (text, deadline) into the local cache."""
+        if not entry:
+            return None
+        text, deadline = entry
+        self.local.set(key, text, deadline - time.time())
+        return text
+
+    def _store(self, key, text, ttl):
+        self.local.set(key, text, ttl)
+        with self._lock:
+            self.fetches += 1
+        return (text, time.time() + ttl) if ttl > 0 else None
+
+    # ------------------------------------------------------------------
+    # Sync (WSGI views)
+    # ------------------------------------------------------------------
+
+    def get(self, key) -> Optional[str]:
+        text = self.local.get(key)
+        if text is None and self.shared:
+            text = self._from_shared(key, self.shared.get(self._shared_key(key)))
+        return text
+
+    def get_or_fetch(self, url: str, fetch, variant: str = "") -> str:
+        """
+        Return the rewritten playlist for `url`.
+        `fetch()` returns (rewritten_text, final_url) and only runs on a miss.
+        `variant` distinguishes different rewrites of the same upstream URL.
+        """
+        key = f"{url}|{variant}"
+        text = self.get(key)
+        self._count(text is not None)
+        if text is not None:
+            return text
+        return self.flight.do(key, lambda: self._fill(key, url, fetch))
+
+    def _fill(self, key, url, fetch):
+        shared = self.shared
+        if shared:
+            shared_key = self._shared_key(key)
+            lock_key = f"{shared_key}:lock"
+            if not shared.add(lock_key, 1, timeout=settings.PROXY_TIMEOUT):
+                # Another worker is fetching it, wait for its result
+                deadline = time.monotonic() + settings.PROXY_TIMEOUT
+                while time.monotonic() < deadline:
+                    time.sleep(LOCK_POLL_INTERVAL)
+                    text = self._from_shared(key, shared.get(shared_key))
+                    if text is not None:
+                        return text
+            try:
+                text, final_url = fetch()
+                ttl = self.ttl_for(text, url, final_url)
+                entry = self._store(key, text, ttl)
+                if entry:
+                    shared.set(shared_key, entry, timeout=ttl)
+                return text
+            finally:
+                shared.delete(lock_key)
+
+        text, final_url = fetch()
+        self._store(key, text, self.ttl_for(text, url, final_url))
+        return text
+
+    # ------------------------------------------------------------------
+    # Async (ASGI views)
+    # ------------------------------------------------------------------
+
+    async def aget_or_fetch(self, url: str, afetch, variant: str = "") -> str:
+        """Async version of get_or_fetch(); `afetch` is a coroutine function."""
+        key = f"{url}|{variant}"
+        text = self.local.get(key)
+        if text is None and self.shared:
+            text = self._from_shared(key, await self.shared.aget(self._shared_key(key)))
+        self._count(text is not None)
+        if text is not None:
+            return text
+        return await self.aflight.do(key, lambda: self._afill(key, url, afetch))
+
+    async def _afill(self, key, url, afetch):
+        shared = self.shared
+        if shared:
+            shared_key = self._shared_key(key)
+            lock_key = f"{shared_key}:lock"
+            if not await shared.aadd(lock_key, 1, timeout=settings.PROXY_TIMEOUT):
+                deadline = time.monotonic() + settings.PROXY_TIMEOUT
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(LOCK_POLL_INTERVAL)
+                    text = self._from_shared(key, await shared.aget(shared_key))
+                    if text is not None:
+                        return text
+            try:
+                text, final_url = await afetch()
+                ttl = self.ttl_for(text, url, final_url)
+                entry = self._store(key, text, ttl)
+                if entry:
+                    await shared.aset(shared_key, entry, timeout=ttl)
+                return text
+            finally:
+                await shared.adelete(lock_key)
+
+        text, final_url = await afetch()
+        self._store(key, text, self.ttl_for(text, url, final_url))
+        return text
+
+    # ------------------------------------------------------------------
+    # Stats
+    # ------------------------------------------------------------------
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "upstreamFetches": self.fetches,
+                "coalesced": max(self.misses - self.fetches, 0),
+                "entries": len(self.local),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_playlist_cache() -> Optional[PlaylistCache]:
+    """Get the process-wide playlist cache, or None when it's disabled."""
+    global _cache
+    if not settings.PLAYLIST_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PlaylistCache(
+                    max_entries=settings.PLAYLIST_CACHE_MAX_ENTRIES,
+                    max_ttl=settings.PLAYLIST_CACHE_MAX_TTL,
+                    default_ttl=settings.PLAYLIST_CACHE_DEFAULT_TTL,
+                    expiry_margin=settings.PLAYLIST_CACHE_EXPIRY_MARGIN,
+                    alias=settings.PLAYLIST_CACHE_ALIAS,
+                )
+    return _cache
@@ -0,0 +1,188 @@
+"""
+Look-ahead segment prefetch.
+
+When a media playlist is served we know exactly which segments the player is
+about to ask for. The prefetcher warms the first PREFETCH_SEGMENTS of them
+into the disk segment cache, and every time a segment is requested it warms
+the next ones. Work runs on a small per-worker thread pool with a bandwidth
+cap, so prefetch never competes with live requests for more than its share.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from django.conf import settings
+
+from .caching import TTLCache
+from .proxy import start_segment_fill
+from .segment_cache import get_segment_cache
+from .upstream import SEGMENT_HEADERS, fetch_segment
+
+logger = logging.getLogger(__name__)
+
+# How long we remember a playlist's segment list / a segment's position in it
+TRACKING_TTL = 1800
+MAX_TRACKED_PLAYLISTS = 500
+MAX_TRACKED_SEGMENTS = 50000
+
+
+class RateLimiter:
+    """Token bucket shared by all prefetch threads; consume() blocks until the bytes are allowed."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.burst = rate  # at most one second's worth at once
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class SegmentPrefetcher:
+    """Warms upcoming segments of recently served playlists into the segment cache."""
+
+    def __init__(self, cache, lookahead, workers, max_queue, max_bytes_per_sec):
+        self.cache = cache
+        self.lookahead = lookahead
+        self.max_queue = max_queue
+        self.limiter = RateLimiter(max_bytes_per_sec)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+
+        # playlist url -> {'segments': [...], 'horizon': highest index scheduled}
+        self.playlists = TTLCache(MAX_TRACKED_PLAYLISTS)
+        # segment cache key -> (playlist url, index)
+        self.positions = TTLCache(MAX_TRACKED_SEGMENTS)
+        self.in_flight = set()
+
+        self._lock = threading.Lock()
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def register(self, playlist_url: str, segment_urls: list):
+        """Remember a freshly fetched media playlist's segments (absolute upstream URLs)."""
+        if not segment_urls:
+            return
+        self.playlists.set(playlist_url, {'segments': segment_urls, 'horizon': -1}, TRACKING_TTL)
+        for index, url in enumerate(segment_urls):
+            self.positions.set(self.cache.key_for(url), (playlist_url, index), TRACKING_TTL)
+
+    def on_playlist(self, playlist_url: str):
+        """A player opened `playlist_url`: warm its first segments."""
+        self._advance(playlist_url, -1)
+
+    def on_segment(self, segment_url: str):
+        """A player fetched `segment_url`: warm the segments after it."""
+        position = self.positions.get(self.cache.key_for(segment_url))
+        if position:
+            self._advance(*position)
+
+    def _advance(self, playlist_url, index):
+        with self._lock:
+            state = self.playlists.get(playlist_url)
+            if state is None:
+                return
+            # Per-episode dedup: many viewers of one episode only move the horizon forward
+            start = max(index + 1, state['horizon'] + 1)
+            end = min(index + 1 + self.lookahead, len(state['segments']))
+            if start >= end:
+                return
+            state['horizon'] = end - 1
+            urls = state['segments'][start:end]
+
+        for url in urls:
+            self._schedule(url)
+
+    def _schedule(self, url):
+        key = self.cache.key_for(url)
+        with self._lock:
+            if key in self.in_flight:
+                return
+            if len(self.in_flight) >= self.max_queue:
+                self.dropped += 1
+                return
+            self.in_flight.add(key)
+            self.scheduled += 1
+        if self.cache.contains(url):
+            self._finish(key, None)
+            return
+        self.pool.submit(self._fetch, url, key)
+
+    def _fetch(self, url, key):
+        ok = False
+        try:
+            # Goes through the breaker, but never hedged: prefetch isn't latency sensitive
+            with fetch_segment(url, SEGMENT_HEADERS, hedge=False) as resp:
+                resp.raise_for_status()
+                writer = start_segment_fill(self.cache, url, resp.headers)
+                if writer is None:
+                    return
+                try:
+                    for chunk in resp.iter_content(chunk_size=settings.PROXY_CHUNK_SIZE):
+                        self.limiter.consume(len(chunk))
+                        writer.write(chunk)
+                except Exception:
+                    writer.abort()
+                    raise
+                writer.commit()
+                ok = True
+        except Exception as e:
+            logger.debug(f"Prefetch failed for {url}: {e}")
+        finally:
+            self._finish(key, ok)
+
+    def _finish(self, key, ok):
+        with self._lock:
+            self.in_flight.discard(key)
+            if ok is True:
+                self.completed += 1
+            elif ok is False:
+                self.failed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "scheduled": self.scheduled,
+                "completed": self.completed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "inFlight": len(self.in_flight),
+                "trackedPlaylists": len(self.playlists),
+            }
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> Optional[SegmentPrefetcher]:
+    """Get the process-wide prefetcher, or None when prefetch (or the segment cache) is off."""
+    global _prefetcher
+    if not settings.PREFETCH_ENABLED:
+        return None
+    cache = get_segment_cache()
+    if cache is None:
+        return None
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = SegmentPrefetcher(
+                    cache,
+                    lookahead=settings.PREFETCH_SEGMENTS,
+                    workers=settings.PREFETCH_WORKERS,
+                    max_queue=settings.PREFETCH_MAX_QUEUE,
+                    max_bytes_per_sec=settings.PREFETCH_MAX_BYTES_PER_SEC,
+                )
+    return _prefetcher
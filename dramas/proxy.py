@@ -0,0 +1,503 @@
+"""
+HLS proxy helpers
+Shared by the blocking proxy views (views.py) and the ASGI ones (async_views.py).
+"""
+import calendar
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import parse_qsl, quote, urljoin, urlsplit
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+
+from .proxy_tokens import get_token_store, table_id
+from .segment_cache import segment_key
+from .upstream import SEGMENT_HEADERS
+
+# Use root-relative paths to avoid Host header/Port stripping issues
+# This ensures the browser resolves valid URLs against the current page origin
+PROXY_M3U8_PATH = "/api/proxy/m3u8/?url="
+PROXY_TS_PATH = "/api/proxy/ts/?url="
+# Compact form, /api/proxy/ts/<token> (proxy_tokens.py)
+PROXY_M3U8_TOKEN_PATH = "/api/proxy/m3u8/"
+PROXY_TS_TOKEN_PATH = "/api/proxy/ts/"
+
+PLAYLIST_CONTENT_TYPE = "application/vnd.apple.mpegurl"
+
+# Tags carrying a URI="..." attribute, and what the URI points at
+URI_TAGS = {
+    '#EXT-X-KEY': 'key',
+    '#EXT-X-SESSION-KEY': 'key',
+    '#EXT-X-MAP': 'init',
+    '#EXT-X-MEDIA': 'playlist',
+    '#EXT-X-I-FRAME-STREAM-INF': 'playlist',
+    '#EXT-X-RENDITION-REPORT': 'playlist',
+    '#EXT-X-PART': 'segment',
+    '#EXT-X-PRELOAD-HINT': 'segment',
+}
+URI_ATTR_RE = re.compile(r'(?<=[:,])URI="([^"]*)"')
+# Tiny objects reused by every segment of an episode, kept in memory (object_cache.py)
+SMALL_OBJECT_KINDS = ('key', 'init')
+
+# Query params that carry a Unix expiry timestamp in signed CDN URLs
+EXPIRY_PARAMS = ('expires', 'expire', 'exp', 'e', 'x-expires', 'deadline')
+# Akamai-style tokens: hdnts=exp=1700000000~acl=/*~hmac=...
+EXPIRY_TOKEN_PARAMS = ('hdnts', 'hdnea', '__token__')
+
+STREAM_INF_BANDWIDTH_RE = re.compile(r'[:,]BANDWIDTH=(\d+)')
+STREAM_INF_RESOLUTION_RE = re.compile(r'[:,]RESOLUTION=(\d+)x(\d+)')
+
+# Single byte range; multi-range requests are answered with the full object
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def is_playlist_url(url: str) -> bool:
+    """Check if an absolute URL points to a playlist rather than a segment."""
+    return '.m3u8' in url or 'm3u8' in url.split('?')[0]
+
+
+def url_expiry(url: str) -> Optional[float]:
+    """
+    Best-effort expiry (Unix time) of a signed upstream URL.
+    Returns None if the URL carries no token we know how to read.
+    """
+    params = {k.lower(): v for k, v in parse_qsl(urlsplit(url).query)}
+    expiries = []
+
+    for name in EXPIRY_PARAMS:
+        if params.get(name, '').isdigit():
+            expiries.append(int(params[name]))
+
+    for name in EXPIRY_TOKEN_PARAMS:
+        for part in params.get(name, '').split('~'):
+            if part.startswith('exp=') and part[4:].isdigit():
+                expiries.append(int(part[4:]))
+
+    # Aliyun type A: auth_key=<issued-at>-<rand>-<uid>-<md5>, valid for a CDN-side TTL
+    issued_at = params.get('auth_key', '').split('-', 1)[0]
+    if issued_at.isdigit():
+        expiries.append(int(issued_at) + settings.SIGNED_URL_AUTH_KEY_TTL)
+
+    # S3/OSS presigned URLs: X-Amz-Date=20240101T000000Z&X-Amz-Expires=3600
+    if params.get('x-amz-expires', '').isdigit() and params.get('x-amz-date'):
+        try:
+            signed_at = calendar.timegm(time.strptime(params['x-amz-date'], '%Y%m%dT%H%M%SZ'))
+            expiries.append(signed_at + int(params['x-amz-expires']))
+        except ValueError:
+            pass
+
+    # Millisecond timestamps
+    expiries = [e / 1000 if e > 10 ** 12 else e for e in expiries]
+    return float(min(expiries)) if expiries else None
+
+
+def proxy_url(absolute_url: str, kind: str) -> str:
+    """Root-relative proxy URL for an upstream resource of the given kind."""
+    encoded_url = quote(absolute_url)
+    if kind == 'playlist':
+        return f"{PROXY_M3U8_PATH}{encoded_url}"
+    if kind in SMALL_OBJECT_KINDS:
+        return f"{PROXY_TS_PATH}{encoded_url}&kind={kind}"
+    return f"{PROXY_TS_PATH}{encoded_url}"
+
+
+def token_url(token: str, kind: str) -> str:
+    """Root-relative compact proxy URL; the kind travels in the token table."""
+    return f"{PROXY_M3U8_TOKEN_PATH if kind == 'playlist' else PROXY_TS_TOKEN_PATH}{token}"
+
+
+def _rewrite_tag(line: str, base_url: str, link=proxy_url) -> str:
+    """Route the URI="..." attribute of a tag through the proxy."""
+    kind = URI_TAGS.get(line.split(':', 1)[0].strip())
+    if not kind:
+        return line
+
+    def replace(match):
+        absolute_url = urljoin(base_url, match.group(1))
+        # Leave data:, skd:// (FairPlay) and other non-HTTP URIs alone
+        if urlsplit(absolute_url).scheme not in ('http', 'https'):
+            return match.group(0)
+        return f'URI="{link(absolute_url, kind)}"'
+
+    return URI_ATTR_RE.sub(replace, line)
+
+
+def rewrite_playlist(content: str, base_url: str, segments: Optional[list] = None) -> str:
+    """
+    Rewrite every URL of an m3u8 playlist so it goes through our proxy:
+    bare URL lines as well as the URI attributes of EXT-X-KEY, EXT-X-MAP,
+    EXT-X-MEDIA and friends.
+    `base_url` is the final (post-redirect) URL the playlist was fetched from.
+    If `segments` is given, the absolute upstream segment URLs are appended to it in order.
+    With PROXY_COMPACT_URLS the URLs become short tokens (proxy_tokens.py).
+    """
+    new_content, table = _rewrite(content, base_url, segments)
+    if table:
+        get_token_store().save(*table)
+    return new_content
+
+
+async def arewrite_playlist(content: str, base_url: str, segments: Optional[list] = None) -> str:
+    """rewrite_playlist() for async views: the token table is saved without blocking the loop."""
+    new_content, table = _rewrite(content, base_url, segments)
+    if table:
+        await get_token_store().asave(*table)
+    return new_content
+
+
+def _rewrite(content, base_url, segments):
+    """The rewritten playlist and, with compact URLs, the (table id, targets) to store."""
+    new_lines = []
+
+    store = get_token_store()
+    if store:
+        tid = table_id(base_url, content)
+        targets = []
+
+        def link(absolute_url, kind):
+            targets.append((absolute_url, kind))
+            return token_url(f"{tid}.{len(targets) - 1}", kind)
+    else:
+        link = proxy_url
+
+    for line in content.splitlines():
+        if not line.strip():
+            new_lines.append(line)
+            continue
+
+        if line.strip().startswith('#'):
+            new_lines.append(_rewrite_tag(line, base_url, link) if 'URI="' in line else line)
+            continue
+
+        # It's a URL
+        original_segment_url = line.strip()
+        absolute_url = urljoin(base_url, original_segment_url)
+
+        # Check if it's a playlist or a segment
+        if is_playlist_url(absolute_url):
+            new_lines.append(link(absolute_url, 'playlist'))
+        else:
+            new_lines.append(link(absolute_url, 'segment'))
+            if segments is not None:
+                segments.append(absolute_url)
+
+    return "\n".join(new_lines), ((tid, targets) if store else None)
+
+
+@dataclass(frozen=True)
+class RenditionPolicy:
+    """Which #EXT-X-STREAM-INF variants of a master playlist we hand out, and in what order."""
+    max_height: Optional[int] = None
+    max_bandwidth: Optional[int] = None
+    order: Optional[str] = None  # 'asc' / 'desc' by bandwidth, None keeps upstream order
+
+    @property
+    def key(self) -> str:
+        """Playlist cache variant for playlists rewritten under this policy."""
+        return f"h{self.max_height or ''}b{self.max_bandwidth or ''}o{self.order or ''}"
+
+
+def _tighter(limit, requested):
+    return min(limit, requested) if limit and requested else limit or requested
+
+
+def rendition_policy(params) -> Optional[RenditionPolicy]:
+    """
+    Effective policy for a request: the PROXY_RENDITION_* settings, tightened
+    by ?max_height= / ?max_bandwidth=. A request can lower the limits, never raise them.
+    """
+    requested = {}
+    for name in ('max_height', 'max_bandwidth'):
+        value = params.get(name, '')
+        requested[name] = int(value) if value.isdigit() and int(value) > 0 else None
+
+    policy = RenditionPolicy(
+        max_height=_tighter(settings.PROXY_RENDITION_MAX_HEIGHT, requested['max_height']),
+        max_bandwidth=_tighter(settings.PROXY_RENDITION_MAX_BANDWIDTH, requested['max_bandwidth']),
+        order=settings.PROXY_RENDITION_ORDER,
+    )
+    return policy if policy != RenditionPolicy() else None
+
+
+def prune_renditions(content: str, policy: Optional[RenditionPolicy]) -> str:
+    """
+    Drop the variants of a master playlist that exceed the policy's limits and
+    reorder the rest. Media playlists come back unchanged. If no variant fits,
+    the lowest-bandwidth one is kept so the stream still plays.
+    """
+    if policy is None or '#EXT-X-STREAM-INF' not in content:
+        return content
+
+    lines = content.splitlines()
+    head, variants, tail = [], [], []
+    block = None
+    for line in lines:
+        stripped = line.strip()
+        if block is not None:
+            block.append(line)
+            if stripped and not stripped.startswith('#'):
+                variants.append(block)
+                block = None
+        elif stripped.startswith('#EXT-X-STREAM-INF'):
+            block = [line]
+        else:
+            (tail if variants else head).append(line)
+
+    def bandwidth(variant):
+        match = STREAM_INF_BANDWIDTH_RE.search(variant[0])
+        return int(match.group(1)) if match else 0
+
+    def fits(variant):
+        if policy.max_bandwidth and bandwidth(variant) > policy.max_bandwidth:
+            return False
+        match = STREAM_INF_RESOLUTION_RE.search(variant[0])
+        return not (policy.max_height and match and int(match.group(2)) > policy.max_height)
+
+    kept = [v for v in variants if fits(v)] or sorted(variants, key=bandwidth)[:1]
+    if policy.order:
+        kept.sort(key=bandwidth, reverse=policy.order == 'desc')
+    return "\n".join(head + [line for variant in kept for line in variant] + tail)
+
+
+def small_object_response(body: bytes, content_type: str, cache_status: str):
+    """Response for an AES key / init segment served from memory."""
+    response = HttpResponse(body, content_type=content_type)
+    response['Access-Control-Allow-Origin'] = '*'
+    response['X-Cache'] = cache_status
+    return response
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies outside the object."""
+
+
+def parse_range(header: str, size: int):
+    """
+    Parse a Range header against an object of `size` bytes.
+    Returns (start, end) inclusive, or None to serve the whole object
+    (no header, other units, multiple ranges - which we don't do - or an
+    invalid spec such as bytes=5-2). Raises RangeNotSatisfiable only for a
+    valid range that starts past the end.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        # Syntactically invalid, so the header is ignored (RFC 9110 14.2)
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def if_range_matches(if_range: str, etag: str, last_modified: str) -> bool:
+    """True if the Range may be honoured given the client's If-Range validator."""
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Only strong ETags can validate a range
+        return bool(etag) and not etag.startswith('W/') and if_range == etag
+    return bool(last_modified) and if_range == last_modified
+
+
+class FileRange:
+    """
+    Read-only window of an open file.
+    It keeps fileno(), so gunicorn's wsgi.file_wrapper can still sendfile()
+    it from the current offset for exactly Content-Length bytes, while
+    servers that iterate in Python stop reading at the end of the window.
+    """
+
+    def __init__(self, f, start: int, length: int):
+        f.seek(start)
+        self._file = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self._file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+
+def cached_segment_response(segment, request, stream=None):
+    """
+    Serve a cached segment straight from disk, honouring Range/If-Range.
+    FileResponse hands the open file to wsgi.file_wrapper, which gunicorn
+    serves with sendfile() - the bytes never pass through Python. With
+    `stream` the body is StreamingHttpResponse(stream(file)) instead (the
+    ASGI views pass an async reader). Returns None if the entry was evicted
+    under us.
+    """
+    status = 200
+    start, end = 0, segment.size - 1
+    range_header = request.headers.get('Range')
+    if range_header and if_range_matches(request.headers.get('If-Range'), segment.etag, segment.last_modified):
+        try:
+            byte_range = parse_range(range_header, segment.size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{segment.size}"
+            response['Access-Control-Allow-Origin'] = '*'
+            return response
+        if byte_range:
+            status = 206
+            start, end = byte_range
+
+    try:
+        f = open(segment.path, 'rb')
+    except FileNotFoundError:
+        return None
+    length = end - start + 1
+    body = FileRange(f, start, length)
+    if stream is None:
+        response = FileResponse(body, content_type=segment.content_type, status=status)
+    else:
+        response = StreamingHttpResponse(stream(body), content_type=segment.content_type, status=status)
+    response['Content-Length'] = length
+    if status == 206:
+        response['Content-Range'] = f"bytes {start}-{end}/{segment.size}"
+    response['Accept-Ranges'] = 'bytes'
+    if segment.etag:
+        response['ETag'] = segment.etag
+    if segment.last_modified:
+        response['Last-Modified'] = segment.last_modified
+    response['Access-Control-Allow-Origin'] = '*'
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def upstream_host_allowed(url: str) -> bool:
+    """
+    Check an upstream URL against PROXY_ALLOWED_HOSTS. An empty list allows
+    any host, except in 'accel' mode where nginx would fetch internal URLs too.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return False
+    allowed = settings.PROXY_ALLOWED_HOSTS
+    if not allowed:
+        return settings.PROXY_SEGMENT_DELIVERY != 'accel'
+    host = parts.hostname.lower()
+    return any(
+        host.endswith(entry) or host == entry[1:] if entry.startswith('.') else host == entry
+        for entry in allowed
+    )
+
+
+def accel_redirect_response(url: str, cache=None):
+    """
+    Hand the segment over to nginx with X-Accel-Redirect.
+    Segments already in our disk cache go to the internal alias location,
+    everything else to the internal upstream location (see dramaflux.nginx),
+    so no video bytes pass through the worker.
+    """
+    response = HttpResponse()
+    segment = cache.lookup(url) if cache else None
+    if segment:
+        response['Content-Type'] = segment.content_type
+        response['X-Accel-Redirect'] = (
+            f"{settings.PROXY_ACCEL_CACHE_LOCATION}{os.path.relpath(segment.path, cache.root)}"
+        )
+        return response
+
+    parts = urlsplit(url)
+    # The token-less cache key lets nginx's proxy_cache share entries across viewers
+    key = cache.key_for(url) if cache else segment_key(url)
+    location = f"{settings.PROXY_ACCEL_UPSTREAM_LOCATION}{key}/{parts.scheme}/{parts.netloc}{parts.path or '/'}"
+    if parts.query:
+        location = f"{location}?{parts.query}"
+    response['X-Accel-Redirect'] = location
+    # Let the upstream's Content-Type through instead of our text/html default
+    del response['Content-Type']
+    return response
+
+
+def upstream_segment_headers(request) -> dict:
+    """Headers for the upstream segment request, forwarding the client's Range/If-Range."""
+    headers = dict(SEGMENT_HEADERS)
+    if request.headers.get('Range'):
+        headers['Range'] = request.headers['Range']
+        # Byte offsets only make sense on the identity encoding
+        headers['Accept-Encoding'] = 'identity'
+        if request.headers.get('If-Range'):
+            headers['If-Range'] = request.headers['If-Range']
+    return headers
+
+
+def copy_segment_headers(response, upstream_headers):
+    """Relay the upstream length/range/validator headers onto our response."""
+    if upstream_headers.get('Content-Length') and not upstream_headers.get('Content-Encoding'):
+        response['Content-Length'] = upstream_headers['Content-Length']
+    for name in ('Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified'):
+        if upstream_headers.get(name):
+            response[name] = upstream_headers[name]
+
+
+def start_segment_fill(cache, url, upstream_headers):
+    """Open a cache writer for an upstream segment response, or None if it can't be cached."""
+    if cache is None:
+        return None
+    expected_size = None
+    # requests/aiohttp decode Content-Encoding, so the length only matches identity bodies
+    if upstream_headers.get('Content-Length') and not upstream_headers.get('Content-Encoding'):
+        expected_size = int(upstream_headers['Content-Length'])
+    return cache.writer(
+        url,
+        content_type=upstream_headers.get('Content-Type', 'application/octet-stream'),
+        expected_size=expected_size,
+        etag=upstream_headers.get('ETag', ''),
+        last_modified=upstream_headers.get('Last-Modified', ''),
+    )
+
+
+class UpstreamStream:
+    """
+    Body of an upstream requests.Response relayed to the client (optionally
+    teed into a segment cache writer). Django calls close() when the response
+    ends, including when the client goes away mid-segment or before the first
+    chunk, so the connection always goes back to the pool and an unfinished
+    cache fill is dropped.
+    """
+
+    def __init__(self, resp, writer=None):
+        self.resp = resp
+        self.writer = writer
+        chunks = resp.iter_content(chunk_size=settings.PROXY_CHUNK_SIZE)
+        self._chunks = writer.tee(chunks) if writer else chunks
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    def close(self):
+        try:
+            self._chunks.close()
+            if self.writer:
+                self.writer.abort()
+        finally:
+            self.resp.close()
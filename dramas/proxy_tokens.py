@@ -0,0 +1,183 @@
+"""
+Compact proxy tokens for rewritten playlists.
+
+Instead of percent-encoding every absolute upstream URL into the playlist,
+the rewriter gives each playlist a table id (a hash of its upstream URL and
+content) and every URI in it becomes /api/proxy/ts/<table>.<index>. The table
+(list of (url, kind)) is stored once per playlist, in process memory and in
+the ProxyTokenTable model so any worker can resolve it. Rows only go away
+once PROXY_TOKEN_TTL has passed - nothing still playing is evicted early.
+Handing out a playlist whose table is past half its lifetime extends the row,
+so issued tokens always have at least half a TTL left, and no worker keeps a
+table in memory beyond the row's expires_at.
+"""
+import base64
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .caching import TTLCache
+from .models import ProxyTokenTable
+
+
+def table_id(base_url: str, content: str) -> str:
+    """Stable id for one rewrite of a playlist; identical playlists share a table."""
+    digest = hashlib.blake2b(f"{base_url}\n{content}".encode(), digest_size=9).digest()
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+class TokenStore:
+    """Bounded table id -> [(url, kind), ...] map, local first, then the database."""
+
+    def __init__(self, max_tables, ttl, purge_interval):
+        self.local = TTLCache(max_tables)
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+
+        self._lock = threading.Lock()
+        self.tables = 0
+        self.hits = 0
+        self.misses = 0
+        self.purged = 0
+
+    def _remember(self, tid, targets, expires_at):
+        """Cache a table locally, never past the expiry of its row."""
+        self.local.set(tid, (targets, expires_at), (expires_at - timezone.now()).total_seconds())
+
+    def _should_purge(self) -> bool:
+        with self._lock:
+            if time.monotonic() < self._next_purge:
+                return False
+            self._next_purge = time.monotonic() + self.purge_interval
+            return True
+
+    def _row_to_save(self, tid, targets) -> Optional[ProxyTokenTable]:
+        """
+        The row to upsert for a table being handed out, or None while the one
+        already stored has more than half its TTL left.
+        """
+        cached = self.local.get(tid)
+        if cached is not None and (cached[1] - timezone.now()).total_seconds() > self.ttl / 2:
+            return None
+        expires_at = timezone.now() + timedelta(seconds=self.ttl)
+        self._remember(tid, targets, expires_at)
+        with self._lock:
+            self.tables += 1
+        return ProxyTokenTable(tid=tid, targets=targets, expires_at=expires_at)
+
+    def save(self, tid: str, targets: list):
+        row = self._row_to_save(tid, targets)
+        if row is None:
+            return
+        # Upsert: a playlist rewritten again keeps its tokens alive for another TTL
+        ProxyTokenTable.objects.bulk_create(
+            [row], update_conflicts=True, unique_fields=['tid'], update_fields=['targets', 'expires_at'],
+        )
+        if self._should_purge():
+            deleted, _ = ProxyTokenTable.objects.filter(expires_at__lte=timezone.now()).delete()
+            with self._lock:
+                self.purged += deleted
+
+    async def asave(self, tid: str, targets: list):
+        """Async version of save()."""
+        row = self._row_to_save(tid, targets)
+        if row is None:
+            return
+        await ProxyTokenTable.objects.abulk_create(
+            [row], update_conflicts=True, unique_fields=['tid'], update_fields=['targets', 'expires_at'],
+        )
+        if self._should_purge():
+            deleted, _ = await ProxyTokenTable.objects.filter(expires_at__lte=timezone.now()).adelete()
+            with self._lock:
+                self.purged += deleted
+
+    @staticmethod
+    def _split(token):
+        tid, _, index = token.rpartition('.')
+        return (tid, int(index)) if tid and index.isdigit() else (None, None)
+
+    def _pick(self, table, index) -> Optional[tuple]:
+        targets = table[0] if table else None
+        target = tuple(targets[index]) if targets and index < len(targets) else None
+        with self._lock:
+            if target is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return target
+
+    def resolve(self, token: str) -> Optional[tuple]:
+        """Return (upstream_url, kind) for a token, or None if unknown/expired."""
+        tid, index = self._split(token)
+        if tid is None:
+            return None
+        table = self.local.get(tid)
+        if table is None:
+            table = ProxyTokenTable.objects.filter(
+                tid=tid, expires_at__gt=timezone.now()
+            ).values_list('targets', 'expires_at').first()
+            if table is not None:
+                self._remember(tid, *table)
+        return self._pick(table, index)
+
+    async def aresolve(self, token: str) -> Optional[tuple]:
+        """Async version of resolve()."""
+        tid, index = self._split(token)
+        if tid is None:
+            return None
+        table = self.local.get(tid)
+        if table is None:
+            table = await ProxyTokenTable.objects.filter(
+                tid=tid, expires_at__gt=timezone.now()
+            ).values_list('targets', 'expires_at').afirst()
+            if table is not None:
+                self._remember(tid, *table)
+        return self._pick(table, index)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tablesSaved": self.tables,
+                "hits": self.hits,
+                "misses": self.misses,
+                "purged": self.purged,
+                "localTables": len(self.local),
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_token_store() -> Optional[TokenStore]:
+    """Get the process-wide token store, or None when playlists carry full URLs."""
+    global _store
+    if not settings.PROXY_COMPACT_URLS:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TokenStore(
+                    max_tables=settings.PROXY_TOKEN_MAX_TABLES,
+                    ttl=settings.PROXY_TOKEN_TTL,
+                    purge_interval=settings.PROXY_TOKEN_PURGE_INTERVAL,
+                )
+    return _store
+
+
+def resolve_token(token: str) -> Optional[tuple]:
+    """(upstream_url, kind) for a compact proxy token, or None."""
+    store = get_token_store()
+    return store.resolve(token) if store else None
+
+
+async def aresolve_token(token: str) -> Optional[tuple]:
+    """Async version of resolve_token()."""
+    store = get_token_store()
+    return await store.aresolve(token) if store else None
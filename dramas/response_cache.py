@@ -0,0 +1,152 @@
+"""
+Catalog-versioned response cache for the read-only cached-* API views.
+
+Between syncs those views compute the same body for the same query, so the
+body is kept in a CACHES alias (locmem per worker, or a shared file/DB
+backend) under a key made of the view name, the catalog version and the
+query params the view actually reads. Sync and admin saves bump
+CatalogState.version, which moves every view to new keys at once - nothing
+is scanned or deleted, old entries just age out. Each worker re-reads the
+version at most every RESPONSE_CACHE_VERSION_CHECK_INTERVAL seconds.
+"""
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from .models import CatalogState
+
+KEY_PREFIX = 'resp'
+
+
+class ResponseCache:
+    """Response bodies keyed on (view, catalog version, normalized params)."""
+
+    def __init__(self, alias, ttl, version_check_interval):
+        self.alias = alias
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+
+        self._version = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+        self.hits = Counter()
+        self.misses = Counter()
+        self.stores = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def version(self) -> int:
+        if time.monotonic() >= self._next_check:
+            with self._lock:
+                if time.monotonic() >= self._next_check:
+                    self._version = CatalogState.current_version()
+                    self._next_check = time.monotonic() + self.version_check_interval
+        return self._version
+
+    def expire_version(self):
+        """Re-read the version on the next request (this worker just bumped it)."""
+        self._next_check = 0.0
+
+    def key(self, name, params: dict) -> str:
+        raw = json.dumps(sorted(params.items()), separators=(',', ':'))
+        digest = hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()
+        return f"{KEY_PREFIX}:{name}:v{self.version()}:{digest}"
+
+    def get(self, name, key):
+        data = self.backend.get(key)
+        with self._lock:
+            if data is None:
+                self.misses[name] += 1
+            else:
+                self.hits[name] += 1
+        return data
+
+    def set(self, key, data):
+        self.backend.set(key, data, self.ttl)
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                "alias": self.alias,
+                "version": self._version,
+                "hits": hits,
+                "misses": misses,
+                "hitRate": round(hits / (hits + misses), 4) if hits + misses else None,
+                "stores": self.stores,
+                "views": {
+                    name: {"hits": self.hits[name], "misses": self.misses[name]}
+                    for name in sorted(set(self.hits) | set(self.misses))
+                },
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Get the process-wide response cache, or None when it's disabled."""
+    global _cache
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    alias=settings.RESPONSE_CACHE_ALIAS,
+                    ttl=settings.RESPONSE_CACHE_TTL,
+                    version_check_interval=settings.RESPONSE_CACHE_VERSION_CHECK_INTERVAL,
+                )
+    return _cache
+
+
+def bump_catalog_version():
+    """Invalidate every cached response (and tell this worker right away)."""
+    CatalogState.bump()
+    cache = get_response_cache()
+    if cache:
+        cache.expire_version()
+
+
+def cached_response(name, params=()):
+    """
+    Cache an APIView.get's 200 responses until the catalog version changes.
+
+    Only the query `params` listed (plus the URL kwargs) make up the key, so
+    unrelated params such as cache busters don't split it.
+    """
+    def decorator(get):
+        @functools.wraps(get)
+        def wrapper(view, request, *args, **kwargs):
+            cache = get_response_cache()
+            if cache is None:
+                return get(view, request, *args, **kwargs)
+
+            key_params = {p: request.query_params.getlist(p) for p in params if p in request.query_params}
+            key_params.update({f":{k}": v for k, v in kwargs.items()})
+            key = cache.key(name, key_params)
+            data = cache.get(name, key)
+            if data is not None:
+                return Response(data, headers={'X-Response-Cache': 'HIT'})
+
+            response = get(view, request, *args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200:
+                cache.set(key, response.data)
+                response['X-Response-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,235 @@
+"""
+In-process search index for the cached catalog.
+
+An inverted index over Drama.name, categories and description, kept in each
+worker's memory. Query terms match whole words, word prefixes, and - when
+neither matches - words sharing enough trigrams (typos). Results are ranked
+by field weight and match quality, then by views.
+
+The index follows CatalogState.version: at most every
+SEARCH_VERSION_CHECK_INTERVAL seconds a worker reads the version, and when a
+sync has bumped it, re-indexes only the dramas changed since the last build.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import CatalogState, Drama
+
+WORD_RE = re.compile(r'\w+')
+
+# How much a match in each field counts
+FIELD_WEIGHTS = {'name': 3.0, 'categories': 2.0, 'description': 1.0}
+# How much each kind of term match counts
+EXACT, PREFIX, FUZZY = 1.0, 0.8, 0.6
+# Extra score when the whole query starts the drama's name
+NAME_PREFIX_BONUS = 2.0
+# Vocabulary words a single prefix may expand to
+MAX_PREFIX_EXPANSIONS = 50
+
+
+def normalize(text: str) -> str:
+    """Casefold and strip accents."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> list:
+    return WORD_RE.findall(normalize(text or ''))
+
+
+def trigrams(word: str) -> set:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Inverted index of active dramas with prefix and trigram lookups."""
+
+    def __init__(self, check_interval, fuzzy_threshold):
+        self.check_interval = check_interval
+        self.fuzzy_threshold = fuzzy_threshold
+
+        # pk -> {'words': {word: weight}, 'name': normalized name, 'categories': set, 'views': int}
+        self.docs = {}
+        # word -> {pk: field weight}
+        self.postings = defaultdict(dict)
+        # trigram -> words containing it
+        self.grams = defaultdict(set)
+        # sorted vocabulary, for prefix matching
+        self.vocab = []
+
+        self.version = None
+        self.built_at = None
+        self._next_check = 0.0
+        self._lock = threading.RLock()
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    def ensure_fresh(self):
+        """Catch up with the catalog if a sync bumped its version since we last looked."""
+        if time.monotonic() < self._next_check:
+            return
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + self.check_interval
+            version = CatalogState.current_version()
+            if version != self.version:
+                self._refresh(version)
+
+    def _refresh(self, version):
+        started = timezone.now()
+        active = dict(Drama.objects.filter(is_active=True).values_list('pk', 'views'))
+
+        for pk in [pk for pk in self.docs if pk not in active]:
+            self._remove(pk)
+        changed = Drama.objects.filter(is_active=True)
+        if self.built_at is not None:
+            changed = changed.filter(last_synced__gte=self.built_at)
+        for drama in changed.only('pk', 'name', 'description', 'categories', 'views'):
+            self._add(drama)
+        for pk, views in active.items():
+            if pk in self.docs:
+                self.docs[pk]['views'] = views
+
+        self.vocab = sorted(self.postings)
+        self.version = version
+        self.built_at = started
+
+    def _add(self, drama):
+        self._remove(drama.pk)
+        words = {}
+        fields = (
+            ('name', drama.name),
+            ('categories', ' '.join(map(str, drama.categories or []))),
+            ('description', drama.description),
+        )
+        for field, text in fields:
+            for word in tokenize(text):
+                words[word] = max(words.get(word, 0), FIELD_WEIGHTS[field])
+        for word, weight in words.items():
+            if word not in self.postings:
+                for gram in trigrams(word):
+                    self.grams[gram].add(word)
+            self.postings[word][drama.pk] = weight
+        self.docs[drama.pk] = {
+            'words': words,
+            'name': normalize(drama.name),
+            'categories': set(drama.categories or []),
+            'views': drama.views,
+        }
+
+    def _remove(self, pk):
+        doc = self.docs.pop(pk, None)
+        if doc is None:
+            return
+        for word in doc['words']:
+            postings = self.postings.get(word)
+            if postings is None:
+                continue
+            postings.pop(pk, None)
+            if not postings:
+                del self.postings[word]
+                for gram in trigrams(word):
+                    self.grams[gram].discard(word)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _expand(self, term) -> dict:
+        """Vocabulary words matching a query term -> match quality."""
+        matches = {}
+        if term in self.postings:
+            matches[term] = EXACT
+        start = bisect.bisect_right(self.vocab, term)
+        for word in self.vocab[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not word.startswith(term):
+                break
+            matches[word] = PREFIX
+        if matches or len(term) < 3:
+            return matches
+
+        # Nothing spelled like it: look for words sharing most trigrams
+        term_grams = trigrams(term)
+        shared = defaultdict(int)
+        for gram in term_grams:
+            for word in self.grams.get(gram, ()):
+                shared[word] += 1
+        for word, common in shared.items():
+            similarity = common / (len(term_grams) + len(trigrams(word)) - common)
+            if similarity >= self.fuzzy_threshold:
+                matches[word] = FUZZY * similarity
+        return matches
+
+    def search(self, query: str, category: Optional[str] = None) -> list:
+        """Ranked pks of active dramas matching every term of `query`."""
+        self.ensure_fresh()
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for word, quality in self._expand(term).items():
+                    for pk, weight in self.postings[word].items():
+                        score = weight * quality
+                        if score > term_scores.get(pk, 0):
+                            term_scores[pk] = score
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pk: s + term_scores[pk] for pk, s in scores.items() if pk in term_scores}
+                if not scores:
+                    return []
+
+            phrase = ' '.join(terms)
+            ranked = []
+            for pk, score in scores.items():
+                doc = self.docs[pk]
+                if category and category not in doc['categories']:
+                    continue
+                if doc['name'].startswith(phrase):
+                    score += NAME_PREFIX_BONUS
+                ranked.append((-score, -doc['views'], pk))
+        ranked.sort()
+        return [pk for _, _, pk in ranked]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "version": self.version,
+                "documents": len(self.docs),
+                "words": len(self.postings),
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index() -> Optional[SearchIndex]:
+    """Get the process-wide search index, or None when search falls back to the database."""
+    global _index
+    if not settings.SEARCH_INDEX_ENABLED:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SearchIndex(
+                    check_interval=settings.SEARCH_VERSION_CHECK_INTERVAL,
+                    fuzzy_threshold=settings.SEARCH_FUZZY_THRESHOLD,
+                )
+    return _index
@@ -0,0 +1,325 @@
+"""
+Disk-backed LRU cache for proxied video segments.
+
+Layout under SEGMENT_CACHE_DIR:
+    <k[:2]>/<key>        segment bytes
+    <k[:2]>/<key>.json   metadata (content type, size, validators)
+    tmp/                 in-progress fills, renamed into place when complete
+
+The filesystem is the index, so every gunicorn worker shares the same cache.
+Recency is the data file's mtime (touched on every hit) and eviction removes
+the oldest files once the total size goes over SEGMENT_CACHE_MAX_BYTES. Each
+worker only sees its own fills, so it also re-measures the directory every
+SEGMENT_CACHE_RESCAN_INTERVAL seconds; other workers' fills can't push the
+cache far past the limit.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Evict down to this fraction of the size limit so we don't evict on every fill
+EVICT_LOW_WATERMARK = 0.9
+# Fills left behind by killed workers are swept after this long
+STALE_TMP_SECONDS = 3600
+
+
+def segment_key(url: str, volatile_params=None) -> str:
+    """Cache key: the upstream URL minus its volatile auth/expiry params."""
+    if volatile_params is None:
+        volatile_params = {p.lower() for p in settings.SEGMENT_CACHE_VOLATILE_PARAMS}
+    parts = urlsplit(url)
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in volatile_params
+    ]
+    stable = f"{parts.netloc}{parts.path}?{urlencode(sorted(query))}"
+    return hashlib.sha256(stable.encode()).hexdigest()
+
+
+@dataclass
+class CachedSegment:
+    """A complete segment on disk."""
+    path: str
+    size: int
+    content_type: str
+    etag: str = ""
+    last_modified: str = ""
+
+
+class SegmentWriter:
+    """
+    Fills one cache entry. Data goes to a temp file and is only renamed into
+    place by commit(), so readers never see a partial segment.
+    """
+
+    def __init__(self, cache, key, meta):
+        self.cache = cache
+        self.key = key
+        self.meta = meta
+        self.size = 0
+        self.tmp_path = os.path.join(cache.tmp_dir, f"{key}.{uuid.uuid4().hex}.part")
+        self._file = open(self.tmp_path, 'wb')
+
+    def write(self, chunk: bytes):
+        if self._file is None:
+            return
+        self._file.write(chunk)
+        self.size += len(chunk)
+        if self.size > self.cache.max_object_bytes:
+            self.abort()
+
+    def tee(self, chunks):
+        """Yield `chunks` unchanged while filling the entry; commit only if all of them arrived."""
+        completed = False
+        try:
+            for chunk in chunks:
+                self.write(chunk)
+                yield chunk
+            completed = True
+        finally:
+            if completed:
+                self.commit()
+            else:
+                self.abort()
+
+    def commit(self):
+        """Atomically publish the entry (data first, then the metadata that makes it visible)."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+
+        expected = self.meta.get('expected_size')
+        if expected is not None and expected != self.size:
+            os.unlink(self.tmp_path)
+            return
+
+        data_path, meta_path = self.cache._paths(self.key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        meta = {k: v for k, v in self.meta.items() if k != 'expected_size'}
+        meta['size'] = self.size
+        meta_tmp = f"{self.tmp_path}.json"
+        with open(meta_tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(self.tmp_path, data_path)
+        os.replace(meta_tmp, meta_path)
+        self.cache._record_fill(self.size)
+
+    def abort(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.unlink(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class SegmentCache:
+    """Bounded on-disk segment store keyed on the token-less upstream URL."""
+
+    def __init__(self, root, max_bytes, max_object_bytes, volatile_params, rescan_interval=30):
+        self.root = str(root)
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self.rescan_interval = rescan_interval
+        self.volatile_params = {p.lower() for p in volatile_params}
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.fills = 0
+        self.evictions = 0
+        self._approx_size = self._scan_size()
+        self._next_scan = time.monotonic() + rescan_interval
+
+    # ------------------------------------------------------------------
+    # Keys and paths
+    # ------------------------------------------------------------------
+
+    def key_for(self, url: str) -> str:
+        return segment_key(url, self.volatile_params)
+
+    def _paths(self, key):
+        data_path = os.path.join(self.root, key[:2], key)
+        return data_path, f"{data_path}.json"
+
+    # ------------------------------------------------------------------
+    # Read / fill
+    # ------------------------------------------------------------------
+
+    def lookup(self, url: str) -> Optional[CachedSegment]:
+        """Return the cached segment for `url` (and mark it recently used), or None."""
+        data_path, meta_path = self._paths(self.key_for(url))
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            os.utime(data_path)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        segment = CachedSegment(
+            path=data_path,
+            size=meta['size'],
+            content_type=meta.get('content_type') or 'application/octet-stream',
+            etag=meta.get('etag', ''),
+            last_modified=meta.get('last_modified', ''),
+        )
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += segment.size
+        return segment
+
+    def contains(self, url: str) -> bool:
+        """Check for a committed entry without touching stats or recency."""
+        return os.path.exists(self._paths(self.key_for(url))[1])
+
+    def writer(self, url: str, content_type: str, expected_size=None,
+               etag: str = "", last_modified: str = "") -> Optional[SegmentWriter]:
+        """Start filling the entry for `url`. Returns None if it can't be cached."""
+        if expected_size is not None and expected_size > self.max_object_bytes:
+            return None
+        meta = {
+            'url': url,
+            'content_type': content_type,
+            'etag': etag,
+            'last_modified': last_modified,
+            'expected_size': expected_size,
+        }
+        try:
+            return SegmentWriter(self, self.key_for(url), meta)
+        except OSError as e:
+            logger.warning(f"Segment cache fill failed: {e}")
+            return None
+
+    # ------------------------------------------------------------------
+    # Eviction
+    # ------------------------------------------------------------------
+
+    def _record_fill(self, size):
+        with self._lock:
+            self.fills += 1
+            self._approx_size += size
+            due = self._approx_size > self.max_bytes or time.monotonic() >= self._next_scan
+            if due:
+                self._next_scan = time.monotonic() + self.rescan_interval
+        if due:
+            self.evict()
+
+    def _entries(self):
+        """Yield (mtime, size, data_path) for every committed entry."""
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name == 'tmp':
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.json'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, st.st_size, entry.path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Re-measure the cache and, if it's over max_bytes, drop least recently
+        used entries until it's under the low watermark.
+        """
+        lock_path = os.path.join(self.root, '.evict.lock')
+        with open(lock_path, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is already evicting
+                return
+
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * EVICT_LOW_WATERMARK if total > self.max_bytes else total
+            evicted = 0
+            for _, size, data_path in entries:
+                if total <= target:
+                    break
+                for path in (f"{data_path}.json", data_path):
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                evicted += 1
+
+            self._sweep_tmp()
+
+        with self._lock:
+            self._approx_size = total
+            self.evictions += evicted
+
+    def _sweep_tmp(self):
+        cutoff = time.time() - STALE_TMP_SECONDS
+        for entry in os.scandir(self.tmp_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    # ------------------------------------------------------------------
+    # Stats
+    # ------------------------------------------------------------------
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bytesSaved": self.bytes_saved,
+                "fills": self.fills,
+                "evictions": self.evictions,
+                "sizeBytes": self._approx_size,
+                "maxBytes": self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_segment_cache() -> Optional[SegmentCache]:
+    """Get the process-wide segment cache, or None when it's disabled."""
+    global _cache
+    if not settings.SEGMENT_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SegmentCache(
+                    root=settings.SEGMENT_CACHE_DIR,
+                    max_bytes=settings.SEGMENT_CACHE_MAX_BYTES,
+                    max_object_bytes=settings.SEGMENT_CACHE_MAX_OBJECT_BYTES,
+                    volatile_params=settings.SEGMENT_CACHE_VOLATILE_PARAMS,
+                    rescan_interval=settings.SEGMENT_CACHE_RESCAN_INTERVAL,
+                )
+    return _cache
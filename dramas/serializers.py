@@ -0,0 +1,64 @@
+"""
+Plain-dict representations of cached models, shared by the cached views and
+the catalog snapshot so both always serve the same shape.
+
+Catalog rows are read with values() - only the columns a response needs, and
+no model instances - then renamed to their JSON keys.
+"""
+
+# JSON key -> Drama column, in response order
+DRAMA_FIELDS = {
+    "dramaId": "drama_id",
+    "name": "name",
+    "description": "description",
+    "cover": "cover_url",
+    "logo": "logo_url",
+    "episodeCount": "episode_count",
+    "orientation": "orientation",
+    "categories": "categories",
+    "views": "views",
+    "syncedEpisodes": "synced_episodes",
+}
+
+# Named field sets for ?fields=
+DRAMA_FIELD_PRESETS = {
+    "card": ("dramaId", "name", "cover"),
+    "full": tuple(DRAMA_FIELDS),
+}
+
+# Columns pagination reads from every row (keyset cursor, ranked lookup)
+ROW_KEY_COLUMNS = ('id', 'views', 'name')
+
+
+def parse_drama_fields(value) -> tuple:
+    """
+    Resolve a ?fields= value (comma separated field names and/or presets)
+    into JSON keys in response order. Empty means the full set; raises
+    ValueError for unknown names.
+    """
+    if not value:
+        return DRAMA_FIELD_PRESETS["full"]
+    wanted = set()
+    for name in (part.strip() for part in value.split(',')):
+        if not name:
+            continue
+        if name in DRAMA_FIELD_PRESETS:
+            wanted.update(DRAMA_FIELD_PRESETS[name])
+        elif name in DRAMA_FIELDS:
+            wanted.add(name)
+        else:
+            raise ValueError(f"Unknown field: {name}")
+    if not wanted:
+        return DRAMA_FIELD_PRESETS["full"]
+    return tuple(key for key in DRAMA_FIELDS if key in wanted)
+
+
+def drama_rows(queryset, fields=DRAMA_FIELD_PRESETS["full"]):
+    """`queryset` as values() rows holding just the columns for `fields` (plus ROW_KEY_COLUMNS)."""
+    columns = dict.fromkeys(ROW_KEY_COLUMNS + tuple(DRAMA_FIELDS[key] for key in fields))
+    return queryset.values(*columns)
+
+
+def drama_list_item(row, fields=DRAMA_FIELD_PRESETS["full"]) -> dict:
+    """A drama_rows() row as listed by /api/cached/dramas/ and the catalog snapshot."""
+    return {key: row[DRAMA_FIELDS[key]] for key in fields}
@@ -1,16 +1,62 @@
 """
 NanoDrama API Service
 Implements correct endpoints from nanodrama.ipynb
+
+get_dramas and get_drama_detail are served stale-while-revalidate per worker:
+the last good response is returned right away, refreshed in the background
+once it's older than its soft TTL, and kept on upstream errors. Callers that
+need a live answer (play URL refresh) pass fresh=True.
 """
+import threading
 import requests
 from typing import Dict, Any, Optional, List
+from django.conf import settings
+from .caching import StaleWhileRevalidate
 from .models import JoliboxConfig
+from . import upstream
+from .upstream import api_headers, api_timeout, get_session
+
+
+_swr_caches = {}
+_swr_lock = threading.Lock()
+
+
+def _is_success(result) -> bool:
+    return isinstance(result, dict) and result.get("code") == "SUCCESS"
+
+
+def _swr_cache(name: str) -> Optional[StaleWhileRevalidate]:
+    """Per-worker SWR cache for 'dramas' or 'detail', or None when disabled."""
+    if not settings.JOLIBOX_SWR_ENABLED:
+        return None
+    cache = _swr_caches.get(name)
+    if cache is None:
+        with _swr_lock:
+            cache = _swr_caches.get(name)
+            if cache is None:
+                prefix = f"JOLIBOX_SWR_{name.upper()}"
+                cache = _swr_caches[name] = StaleWhileRevalidate(
+                    soft_ttl=getattr(settings, f"{prefix}_SOFT_TTL"),
+                    max_stale=getattr(settings, f"{prefix}_MAX_STALE"),
+                    max_stale_on_error=getattr(settings, f"{prefix}_MAX_STALE_ON_ERROR"),
+                    max_entries=settings.JOLIBOX_SWR_MAX_ENTRIES,
+                    workers=settings.JOLIBOX_SWR_WORKERS,
+                    is_valid=_is_success,
+                    name=f"jolibox-{name}",
+                )
+    return cache
+
+
+def service_cache_stats() -> Optional[Dict[str, Any]]:
+    if not settings.JOLIBOX_SWR_ENABLED:
+        return None
+    return {name: _swr_cache(name).stats() for name in ('dramas', 'detail')}
 
 
 class JoliboxService:
     """Service class for interacting with NanoDrama API."""
     
-    BASE_URL = "https://www.nanodrama.com/api"
+    BASE_URL = upstream.BASE_URL
     
     def __init__(self, config: Optional[JoliboxConfig] = None):
         self.config = config or JoliboxConfig.get_config()
@@ -18,37 +64,20 @@ class JoliboxService:
             raise ValueError("No Jolibox configuration found. Please add one via admin panel.")
     
     def _get_headers(self, drama_id: str = None, episode_num: int = None) -> Dict[str, str]:
-        """Get request headers with authentication."""
-        headers = {
-            "accept": "application/json, text/plain, */*",
-            "accept-language": "en",
-            "referer": "https://www.nanodrama.com/",
-            "sec-ch-ua": '"Google Chrome";v="143", "Chromium";v="143", "Not A(Brand";v="24"',
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": '"Windows"',
-            "sec-fetch-dest": "empty",
-            "sec-fetch-mode": "cors",
-            "sec-fetch-site": "same-origin",
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/143.0.0.0 Safari/537.36",
-            "x-joli-accept-language": "en",
-            "x-joli-source": self.config.joli_source_token,
-            "x-os-type": "ANDROID",
-            "x-runtime-type": "WEB",
-        }
-        
-        # Add user agent for detail/unlock endpoints
-        if drama_id:
-            headers["x-user-agent"] = f"JoliboxMinidramaWeb (PC; undefined; 10; en) uuid/{self.config.device_id} adid/ version/2.4.0"
-            if episode_num:
-                headers["referer"] = f"https://www.nanodrama.com/drama/{drama_id}/{episode_num}"
-        
-        return headers
+        """Get request headers with authentication (shared template, don't mutate)."""
+        return api_headers(self.config, drama_id, episode_num)
     
-    def get_dramas(self, limit: int = 2000) -> Dict[str, Any]:
+    def get_dramas(self, limit: int = 2000, fresh: bool = False) -> Dict[str, Any]:
         """
-        Fetch list of dramas from NanoDrama API.
+        Fetch list of dramas from NanoDrama API (possibly a stale copy, see module docstring).
         Endpoint: GET /dramas?tag=ALL&limit=2000&reqId=dramaflux
         """
+        cache = _swr_cache('dramas')
+        if cache is None or fresh:
+            return self._fetch_dramas(limit)
+        return cache.get(limit, lambda: self._fetch_dramas(limit))
+
+    def _fetch_dramas(self, limit: int) -> Dict[str, Any]:
         url = f"{self.BASE_URL}/dramas"
         params = {
             "tag": "ALL",
@@ -57,7 +86,7 @@ class JoliboxService:
         }
         
         try:
-            response = requests.get(url, headers=self._get_headers(), params=params, timeout=30)
+            response = get_session().get(url, headers=self._get_headers(), params=params, timeout=api_timeout())
             response.raise_for_status()
             result = response.json()
             
@@ -72,20 +101,26 @@ class JoliboxService:
         except requests.RequestException as e:
             return {"code": "ERROR", "message": str(e), "data": []}
     
-    def get_drama_detail(self, drama_id: str, episode_num: int = 1) -> Dict[str, Any]:
+    def get_drama_detail(self, drama_id: str, episode_num: int = 1, fresh: bool = False) -> Dict[str, Any]:
         """
-        Get drama detail with specific episode.
+        Get drama detail with specific episode (possibly a stale copy, see module docstring).
         Endpoint: GET /dramas/{dramaId}/detail?episodeNum=1
         """
+        cache = _swr_cache('detail')
+        if cache is None or fresh:
+            return self._fetch_drama_detail(drama_id, episode_num)
+        return cache.get((drama_id, episode_num), lambda: self._fetch_drama_detail(drama_id, episode_num))
+
+    def _fetch_drama_detail(self, drama_id: str, episode_num: int) -> Dict[str, Any]:
         url = f"{self.BASE_URL}/dramas/{drama_id}/detail"
         params = {"episodeNum": episode_num}
         
         try:
-            response = requests.get(
+            response = get_session().get(
                 url, 
                 headers=self._get_headers(drama_id, episode_num), 
                 params=params, 
-                timeout=30
+                timeout=api_timeout()
             )
             response.raise_for_status()
             result = response.json()
@@ -113,11 +148,11 @@ class JoliboxService:
         }
         
         try:
-            response = requests.get(
+            response = get_session().get(
                 url, 
                 headers=self._get_headers(drama_id, episode_num), 
                 params=params, 
-                timeout=30
+                timeout=api_timeout()
             )
             response.raise_for_status()
             result = response.json()
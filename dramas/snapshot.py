@@ -0,0 +1,191 @@
+"""
+Precompressed snapshot of the whole cached catalog.
+
+Built once at the end of every sync: the active dramas serialized to JSON in
+catalog order, plus gzip and (when the brotli package is installed) brotli
+copies, all under a content-hash name in SNAPSHOT_DIR. catalog.meta.json
+points at the current one. /api/cached/catalog/ serves the best encoding the
+client accepts and answers If-None-Match with a 304; each encoding has its
+own ETag (the content hash plus a -gz/-br suffix).
+
+Admin edits only bump CatalogState. A worker that finds the version ahead of
+the snapshot's (checked every SNAPSHOT_VERSION_CHECK_INTERVAL seconds)
+rebuilds it in a background thread and keeps serving the previous snapshot
+meanwhile. Builds take an flock in SNAPSHOT_DIR, so only one process writes
+at a time, and they delete old files only once the new meta is in place -
+never the files of the new or the previous snapshot.
+"""
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .models import CatalogState, Drama
+from .pagination import CATALOG_ORDER
+from .serializers import drama_list_item, drama_rows
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+META_NAME = 'catalog.meta.json'
+LOCK_NAME = '.build.lock'
+# File name and ETag suffix of each encoding
+SUFFIXES = {'identity': '', 'gzip': '.gz', 'br': '.br'}
+
+_meta_cache = {'mtime': None, 'meta': None, 'next_check': 0.0}
+_rebuild_lock = threading.Lock()
+_rebuilding = False
+
+
+def _write_atomic(path, data: bytes):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_snapshot(min_version=None) -> dict:
+    """
+    Serialize and compress the catalog; returns the new meta (etags, version,
+    file names). With `min_version`, a snapshot at least that new which another
+    thread or process finished meanwhile is returned instead of building again.
+    """
+    directory = str(settings.SNAPSHOT_DIR)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_NAME), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        previous = _read_meta()
+        if min_version is not None and previous and previous['version'] >= min_version:
+            return previous
+
+        version = CatalogState.current_version()
+        rows = drama_rows(Drama.objects.filter(is_active=True).order_by(*CATALOG_ORDER))
+        data = [drama_list_item(row) for row in rows]
+        body = json.dumps({
+            "code": "SUCCESS",
+            "message": "success",
+            "data": data,
+            "total": len(data),
+            "version": version,
+        }, ensure_ascii=False, separators=(',', ':')).encode()
+
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        files = {'identity': f"catalog-{digest}.json"}
+        encoded = {'gzip': gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            encoded['br'] = brotli.compress(body, quality=11)
+
+        _write_atomic(os.path.join(directory, files['identity']), body)
+        for encoding, payload in encoded.items():
+            name = files['identity'] + SUFFIXES[encoding]
+            _write_atomic(os.path.join(directory, name), payload)
+            files[encoding] = name
+
+        etags = {encoding: f'"{digest}{SUFFIXES[encoding].replace(".", "-")}"' for encoding in files}
+        meta = {'etags': etags, 'version': version, 'files': files}
+        _write_atomic(os.path.join(directory, META_NAME), json.dumps(meta).encode())
+
+        # Older snapshots are no longer referenced. The previous one is kept
+        # for workers that read its meta just before this one replaced it.
+        keep = set(files.values()) | set(previous['files'].values() if previous else ())
+        for name in os.listdir(directory):
+            if name.startswith('catalog-') and name not in keep:
+                try:
+                    os.unlink(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+        logger.info(f"Catalog snapshot {digest}: {len(data)} dramas, {len(body)} bytes")
+        return meta
+
+
+def _read_meta():
+    """The snapshot meta on disk (cached per worker by mtime), or None if there is no usable one."""
+    path = os.path.join(str(settings.SNAPSHOT_DIR), META_NAME)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _meta_cache['mtime'] != mtime:
+        with open(path) as f:
+            meta = json.load(f)
+        if 'etags' not in meta:
+            # Written before per-encoding ETags
+            return None
+        _meta_cache['meta'] = meta
+        _meta_cache['mtime'] = mtime
+    return _meta_cache['meta']
+
+
+def current_snapshot() -> dict:
+    """
+    Meta of the current snapshot. Built right away only if there is none yet;
+    one behind the catalog version is served while a background rebuild runs.
+    """
+    meta = _read_meta()
+    if meta is None:
+        return build_snapshot()
+    if time.monotonic() >= _meta_cache['next_check']:
+        _meta_cache['next_check'] = time.monotonic() + settings.SNAPSHOT_VERSION_CHECK_INTERVAL
+        version = CatalogState.current_version()
+        if version > meta['version']:
+            _rebuild_in_background(version)
+    return meta
+
+
+def _rebuild_in_background(version):
+    """Start one rebuild thread per worker unless one is already running."""
+    global _rebuilding
+    with _rebuild_lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+    threading.Thread(target=_rebuild, args=(version,), name='snapshot-rebuild', daemon=True).start()
+
+
+def _rebuild(version):
+    global _rebuilding
+    try:
+        build_snapshot(min_version=version)
+    except Exception as e:
+        logger.error(f"Catalog snapshot rebuild failed: {e}")
+    finally:
+        connection.close()
+        with _rebuild_lock:
+            _rebuilding = False
+
+
+def snapshot_path(name: str) -> str:
+    return os.path.join(str(settings.SNAPSHOT_DIR), name)
+
+
+def choose_encoding(accept_encoding: str, available) -> str:
+    """Best of br/gzip the client accepts and we have, else identity."""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = q
+    for encoding in ('br', 'gzip'):
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return 'identity'
@@ -4,17 +4,19 @@ Prioritizes accuracy and completeness over speed.
 Processes one by one to ensure every episode is unlocked.
 """
 import asyncio
-import aiohttp
 import logging
 import random
 from django.utils import timezone
 from asgiref.sync import sync_to_async
-from .models import Drama, Episode, JoliboxConfig, SyncLog
+from .models import CatalogState, Category, Drama, Episode, JoliboxConfig, SyncLog
+from . import upstream
+from .snapshot import build_snapshot
+from .upstream import api_headers, async_api_timeout, get_async_session
 
 logger = logging.getLogger(__name__)
 
 class ReliableDramaSyncService:
-    BASE_URL = "https://www.nanodrama.com/api"
+    BASE_URL = upstream.BASE_URL
 
     def __init__(self):
         self.config = JoliboxConfig.get_config()
@@ -22,21 +24,7 @@ class ReliableDramaSyncService:
             raise ValueError("No Jolibox configuration found")
 
     def _get_headers(self, drama_id: str = None, episode_num: int = None) -> dict:
-        headers = {
-            "accept": "application/json",
-            "accept-language": "en",
-            "referer": "https://www.nanodrama.com/",
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "x-joli-accept-language": "en",
-            "x-joli-source": self.config.joli_source_token,
-            "x-os-type": "ANDROID",
-            "x-runtime-type": "WEB",
-        }
-        if drama_id:
-            headers["x-user-agent"] = f"JoliboxMinidramaWeb (PC; undefined; 10; en) uuid/{self.config.device_id} adid/ version/2.4.0"
-            if episode_num:
-                 headers["referer"] = f"https://www.nanodrama.com/drama/{drama_id}/{episode_num}"
-        return headers
+        return api_headers(self.config, drama_id, episode_num)
 
     async def start_sync(self):
         """Main entry point for reliable sync."""
@@ -48,7 +36,8 @@ class ReliableDramaSyncService:
         )
         
         try:
-            async with aiohttp.ClientSession() as session:
+            # Shared pooled session, closed with this short-lived event loop
+            async with get_async_session() as session:
                 # 1. Fetch and store all dramas first
                 print("Step 1: Fetching all dramas...")
                 dramas_count = await self.fetch_all_dramas(session)
@@ -90,13 +79,19 @@ class ReliableDramaSyncService:
         log.errors = error
         log.completed_at = timezone.now()
         log.save()
+        # Episodes were unlocked along the way, readers re-check the catalog
+        CatalogState.bump()
+        try:
+            build_snapshot()
+        except Exception as e:
+            logger.error(f"Catalog snapshot build failed: {e}")
 
     async def fetch_all_dramas(self, session):
         url = f"{self.BASE_URL}/dramas"
         params = {"tag": "ALL", "limit": 2000, "reqId": "dramaflux"}
         
         try:
-            async with session.get(url, headers=self._get_headers(), params=params) as resp:
+            async with session.get(url, headers=self._get_headers(), params=params, timeout=async_api_timeout()) as resp:
                 result = await resp.json()
                 if result.get('code') == 'SUCCESS':
                     dramas_list = result.get('data', [])
@@ -107,8 +102,12 @@ class ReliableDramaSyncService:
         return 0
 
     def _save_dramas_batch(self, dramas_list):
+        names = {str(c) for data in dramas_list for c in (data.get('categories') or [])}
+        Category.objects.bulk_create([Category(name=n) for n in names], ignore_conflicts=True)
+        category_ids = dict(Category.objects.filter(name__in=names).values_list('name', 'pk'))
+
         for data in dramas_list:
-            Drama.objects.update_or_create(
+            drama, _ = Drama.objects.update_or_create(
                 drama_id=data.get('dramaId'),
                 defaults={
                     'name': data.get('name') or '',
@@ -123,6 +122,11 @@ class ReliableDramaSyncService:
                     'is_active': data.get('channelActive', True),
                 }
             )
+            drama.normalized_categories.set(
+                [category_ids[str(c)] for c in (data.get('categories') or [])]
+            )
+        Category.recount_dramas()
+        CatalogState.bump()
 
     async def process_drama_episodes(self, session, drama, sync_log=None):
         """Unlock all episodes for a drama sequentially."""
@@ -159,7 +163,7 @@ class ReliableDramaSyncService:
             unlock_url = f"{self.BASE_URL}/dramas/ads/unlock"
             u_params = {"dramaId": drama.drama_id, "sessionId": "dramaflux", "episodeNum": ep_num}
             
-            async with session.get(unlock_url, headers=self._get_headers(drama.drama_id, ep_num), params=u_params) as resp:
+            async with session.get(unlock_url, headers=self._get_headers(drama.drama_id, ep_num), params=u_params, timeout=async_api_timeout()) as resp:
                 await resp.read() # Consume response
             
             await asyncio.sleep(1) # Wait for server propagation
@@ -168,7 +172,7 @@ class ReliableDramaSyncService:
             detail_url = f"{self.BASE_URL}/dramas/{drama.drama_id}/detail"
             d_params = {"episodeNum": ep_num}
             
-            async with session.get(detail_url, headers=self._get_headers(drama.drama_id), params=d_params) as resp:
+            async with session.get(detail_url, headers=self._get_headers(drama.drama_id), params=d_params, timeout=async_api_timeout()) as resp:
                 data = await resp.json()
                 
                 if data.get('code') == 'SUCCESS':
@@ -190,3 +194,4 @@ class ReliableDramaSyncService:
             episode_number=ep_num,
             defaults={'video_url': url, 'is_unlocked': True}
         )
+        Drama.recount_synced_episodes([drama.pk])
@@ -1,3 +1,764 @@
-from django.test import TestCase
+import asyncio
+import calendar
+import concurrent.futures
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import caching, proxy, snapshot, upstream
+from .admin import CategoryAdmin, DramaAdmin
+from .caching import StaleWhileRevalidate
+from .models import CatalogState, Category, Drama, ProxyTokenTable
+from .pagination import CATALOG_ORDER, decode_cursor, encode_cursor, keyset_page
+from .play_urls import PlayUrlResolver
+from .proxy import RangeNotSatisfiable, RenditionPolicy, if_range_matches, parse_range, prune_renditions, url_expiry
+from .proxy_tokens import TokenStore
+from .search import SearchIndex
+
+
+class FakeResponse:
+    """Stands in for a requests.Response / aiohttp.ClientResponse."""
+
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+        self.closed_event = threading.Event()
+        self.released = False
+
+    def close(self):
+        self.closed = True
+        self.closed_event.set()
+
+    def release(self):
+        self.released = True
+
+
+class HedgedFetchTests(SimpleTestCase):
+    """fetch_segment/afetch_segment must hand back one response and free every other one."""
+
+    def setUp(self):
+        patcher = mock.patch.object(upstream.HostHealth, 'hedge_delay', return_value=0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def url(self):
+        return f"https://{self.id().rsplit('.', 1)[-1].replace('_', '-')}.example.com/seg.ts"
+
+    # -- sync ----------------------------------------------------------
+
+    def fetch(self, timed_get):
+        with mock.patch.object(upstream, '_timed_get', side_effect=timed_get):
+            return upstream.fetch_segment(self.url(), {})
+
+    def test_sync_fast_path(self):
+        fast = FakeResponse('first')
+        resp = self.fetch(lambda url, headers, health: fast)
+        self.assertIs(resp, fast)
+        self.assertFalse(fast.closed)
+
+    def test_sync_first_request_does_not_queue_behind_hedges(self):
+        busy = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        self.addCleanup(busy.shutdown)
+        self.addCleanup(release.set)
+        busy.submit(release.wait)
+        fast = FakeResponse('first')
+        with mock.patch.object(upstream, '_get_hedge_pool', return_value=busy):
+            self.assertIs(self.fetch(lambda url, headers, health: fast), fast)
+
+    def test_sync_hedge_win_closes_slow_request(self):
+        slow_request_answers = threading.Event()
+        responses = []
+
+        def timed_get(url, headers, health):
+            resp = FakeResponse(len(responses))
+            responses.append(resp)
+            if resp.name == 0:
+                slow_request_answers.wait(5)
+            return resp
+
+        resp = self.fetch(timed_get)
+        self.assertIs(resp, responses[1])
+        slow_request_answers.set()
+        self.assertTrue(responses[0].closed_event.wait(5))
+        self.assertFalse(responses[1].closed)
+
+    def test_sync_double_completion_closes_the_other(self):
+        second_started = threading.Event()
+        responses = []
+
+        def timed_get(url, headers, health):
+            resp = FakeResponse(len(responses))
+            responses.append(resp)
+            if resp.name == 0:
+                second_started.wait(1)
+            else:
+                second_started.set()
+            return resp
+
+        real_wait = concurrent.futures.wait
+
+        def wait_for_both(fs, timeout=None, return_when=None):
+            if return_when is None:
+                return real_wait(fs, timeout=timeout)
+            return real_wait(fs, return_when=concurrent.futures.ALL_COMPLETED)
+
+        with mock.patch.object(upstream, 'wait', side_effect=wait_for_both):
+            resp = self.fetch(timed_get)
+        others = [r for r in responses if r is not resp]
+        self.assertEqual(len(others), 1)
+        self.assertFalse(resp.closed)
+        self.assertTrue(others[0].closed)
+
+    # -- async ---------------------------------------------------------
+
+    def afetch(self, atimed_get, wait=None):
+        async def run():
+            with mock.patch.object(upstream, '_atimed_get', side_effect=atimed_get):
+                resp = await upstream.afetch_segment(self.url(), {})
+                # Let cancelled losers finish (and be released)
+                others = asyncio.all_tasks() - {asyncio.current_task()}
+                await asyncio.wait_for(asyncio.gather(*others, return_exceptions=True), 5)
+                return resp
+        if wait is None:
+            return asyncio.run(run())
+        with mock.patch.object(upstream.asyncio, 'wait', side_effect=wait):
+            return asyncio.run(run())
+
+    def test_async_fast_path_keeps_winner(self):
+        fast = FakeResponse('first')
+
+        async def atimed_get(url, headers, health):
+            return fast
+
+        resp = self.afetch(atimed_get)
+        self.assertIs(resp, fast)
+        self.assertFalse(fast.released)
+
+    def test_async_hedge_win_cancels_slow_request(self):
+        responses = []
+
+        async def atimed_get(url, headers, health):
+            resp = FakeResponse(len(responses))
+            responses.append(resp)
+            if resp.name == 0:
+                await asyncio.Event().wait()  # never answers, must be cancelled
+            return resp
+
+        resp = self.afetch(atimed_get)
+        self.assertIs(resp, responses[1])
+        self.assertFalse(responses[1].released)
+
+    def test_async_double_completion_releases_the_other(self):
+        responses = []
+        second_started = None
+
+        async def atimed_get(url, headers, health):
+            resp = FakeResponse(len(responses))
+            responses.append(resp)
+            if resp.name == 0:
+                await second_started.wait()
+            else:
+                second_started.set()
+            return resp
+
+        real_wait = asyncio.wait
+
+        async def wait_for_both(fs, timeout=None, return_when=asyncio.ALL_COMPLETED):
+            nonlocal second_started
+            if second_started is None:
+                second_started = asyncio.Event()
+            if return_when == asyncio.FIRST_COMPLETED:
+                return_when = asyncio.ALL_COMPLETED
+            return await real_wait(fs, timeout=timeout, return_when=return_when)
+
+        resp = self.afetch(atimed_get, wait=wait_for_both)
+        others = [r for r in responses if r is not resp]
+        self.assertEqual(len(others), 1)
+        self.assertFalse(resp.released)
+        self.assertTrue(others[0].released)
+
+
+@override_settings(UPSTREAM_BREAKER_FAILURES=1, UPSTREAM_BREAKER_COOLDOWN=10, UPSTREAM_BREAKER_PROBE_TIMEOUT=30)
+class CircuitBreakerTests(SimpleTestCase):
+    """Half-open probes of the per-host breaker."""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(upstream, 'time', SimpleNamespace(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def half_open(self):
+        health = upstream.HostHealth()
+        health.record_failure()
+        self.assertFalse(health.allow())
+        self.now += 10
+        self.assertTrue(health.allow())
+        self.assertFalse(health.allow())
+        return health
+
+    def test_probe_decides(self):
+        health = self.half_open()
+        health.record_success(0.1)
+        self.assertEqual(health.state, 'closed')
+        health = self.half_open()
+        health.record_failure()
+        self.assertEqual(health.state, 'open')
+        self.assertFalse(health.allow())
+
+    def test_cancelled_probe_lets_the_next_one_through(self):
+        health = self.half_open()
+        session = SimpleNamespace(get=lambda url, headers: asyncio.sleep(3600))
+
+        async def cancel_probe():
+            task = asyncio.ensure_future(upstream._atimed_get('https://cdn.example.com/seg.ts', {}, health))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.object(upstream, 'get_async_session', return_value=session):
+            asyncio.run(cancel_probe())
+        self.assertTrue(health.allow())
+
+    def test_stuck_probe_expires(self):
+        health = self.half_open()
+        self.now += 29
+        self.assertFalse(health.allow())
+        self.now += 1
+        self.assertTrue(health.allow())
+
+
+class StaleWhileRevalidateTests(SimpleTestCase):
+    """Fresh/stale/miss behaviour of the SWR cache behind JoliboxService."""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(caching, 'time', SimpleNamespace(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cache(self, **kwargs):
+        options = {'soft_ttl': 5, 'max_stale': 30, 'is_valid': lambda value: value != 'bad'}
+        options.update(kwargs)
+        cache = StaleWhileRevalidate(**options)
+        # Background refreshes are tracked so tests can wait for them to finish
+        cache._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(cache._executor.shutdown)
+        cache.refreshes_started = []
+        submit = cache._executor.submit
+
+        def tracked_submit(*args):
+            future = submit(*args)
+            cache.refreshes_started.append(future)
+            return future
+        cache._executor.submit = tracked_submit
+        return cache
+
+    @staticmethod
+    def loader(*values):
+        """Loader returning `values` in turn; `.calls` counts the calls."""
+        results = iter(values)
+
+        def load():
+            load.calls += 1
+            value = next(results)
+            if isinstance(value, Exception):
+                raise value
+            return value
+        load.calls = 0
+        return load
+
+    def wait_for_refreshes(self, cache):
+        _, pending = concurrent.futures.wait(cache.refreshes_started, timeout=5)
+        self.assertFalse(pending, "background refresh did not finish")
+
+    def test_miss_then_fresh_hit(self):
+        cache = self.cache()
+        load = self.loader('a', 'b')
+        self.assertEqual(cache.get('k', load), 'a')
+        self.now += 4
+        self.assertEqual(cache.get('k', load), 'a')
+        self.assertEqual(load.calls, 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['freshHits'], 1)
+
+    def test_stale_value_served_while_one_refresh_runs(self):
+        cache = self.cache()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            if len(calls) > 1:
+                release.wait(5)
+            return len(calls)
+
+        self.assertEqual(cache.get('k', load), 1)
+        self.now += 6
+        for _ in range(5):
+            self.assertEqual(cache.get('k', load), 1)
+        release.set()
+        self.wait_for_refreshes(cache)
+        self.assertEqual(len(cache.refreshes_started), 1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(cache.get('k', load), 2)
+        self.assertEqual(cache.stats()['refreshes'], 1)
+
+    def test_concurrent_misses_load_once(self):
+        cache = self.cache()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            release.wait(5)
+            return 'a'
+
+        # Let the load finish only once every caller has joined the flight
+        entered = threading.Semaphore(0)
+        flight_do = cache._flight.do
+
+        def counted_do(key, fn):
+            entered.release()
+            return flight_do(key, fn)
+        cache._flight.do = counted_do
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('k', load))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            self.assertTrue(entered.acquire(timeout=5))
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['a'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_invalid_results_are_never_stored(self):
+        cache = self.cache()
+        load = self.loader('bad', 'good')
+        self.assertEqual(cache.get('k', load), 'bad')
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.get('k', load), 'good')
+        self.assertEqual(load.calls, 2)
+
+    def test_failed_refresh_keeps_last_good_value(self):
+        cache = self.cache()
+        load = self.loader('good', 'bad', RuntimeError('down'))
+        cache.get('k', load)
+        self.now += 6
+        self.assertEqual(cache.get('k', load), 'good')
+        self.wait_for_refreshes(cache)
+        self.assertEqual(cache.get('k', load), 'good')
+        self.wait_for_refreshes(cache)
+        self.assertEqual(cache.stats()['refreshFailures'], 2)
+
+    def test_stale_on_error_is_bounded(self):
+        cache = self.cache(soft_ttl=1, max_stale=5, max_stale_on_error=20)
+        load = self.loader('good', RuntimeError('down'), RuntimeError('down'))
+        cache.get('k', load)
+        self.now += 7
+        # Past max_stale the caller loads; upstream fails, the recent value stands in
+        self.assertEqual(cache.get('k', load), 'good')
+        self.assertEqual(cache.stats()['staleOnError'], 1)
+        self.now += 20
+        with self.assertRaises(RuntimeError):
+            cache.get('k', load)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_nothing_served_past_max_stale_by_default(self):
+        cache = self.cache(soft_ttl=1, max_stale=5)
+        load = self.loader('good', 'bad')
+        cache.get('k', load)
+        self.now += 7
+        self.assertEqual(cache.get('k', load), 'bad')
+
+
+class RangeTests(SimpleTestCase):
+    """Range/If-Range handling for segments served from the disk cache."""
+
+    def test_whole_object_without_a_usable_range(self):
+        for header in ('', 'items=0-9', 'bytes=0-1,4-5', 'bytes=-'):
+            self.assertIsNone(parse_range(header, 100), header)
+
+    def test_closed_and_open_ranges(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=90-500', 100), (90, 99))
+
+    def test_suffix_ranges(self):
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=-0', 100)
+
+    def test_invalid_range_is_ignored(self):
+        self.assertIsNone(parse_range('bytes=5-2', 100))
+
+    def test_range_past_the_end_is_not_satisfiable(self):
+        for header in ('bytes=100-', 'bytes=150-200'):
+            with self.assertRaises(RangeNotSatisfiable):
+                parse_range(header, 100)
+
+    def test_if_range(self):
+        date = 'Wed, 01 Jan 2025 00:00:00 GMT'
+        self.assertTrue(if_range_matches('', '"a"', date))
+        self.assertTrue(if_range_matches('"a"', '"a"', date))
+        self.assertFalse(if_range_matches('"b"', '"a"', date))
+        self.assertFalse(if_range_matches('W/"a"', 'W/"a"', date))
+        self.assertTrue(if_range_matches(date, '"a"', date))
+        self.assertFalse(if_range_matches(date, '"a"', ''))
+
+
+@override_settings(SIGNED_URL_AUTH_KEY_TTL=1800)
+class UrlExpiryTests(SimpleTestCase):
+    """Expiry read from the signing params of upstream URLs."""
+
+    def test_unsigned_url(self):
+        self.assertIsNone(url_expiry('https://cdn.example.com/v/index.m3u8?quality=hd'))
+
+    def test_expiry_params(self):
+        self.assertEqual(url_expiry('https://cdn.example.com/a.m3u8?Expires=1700000000'), 1700000000.0)
+        self.assertEqual(url_expiry('https://cdn.example.com/a.m3u8?exp=1700000000000'), 1700000000.0)
+
+    def test_token_params(self):
+        url = 'https://cdn.example.com/a.m3u8?hdnts=exp=1700000000~acl=/*~hmac=ab12'
+        self.assertEqual(url_expiry(url), 1700000000.0)
+
+    def test_auth_key(self):
+        url = 'https://cdn.example.com/a.m3u8?auth_key=1700000000-0-0-0123abcd'
+        self.assertEqual(url_expiry(url), 1700000000.0 + 1800)
+
+    def test_presigned(self):
+        url = 'https://bucket.example.com/a.m3u8?X-Amz-Date=20240101T000000Z&X-Amz-Expires=3600'
+        self.assertEqual(url_expiry(url), calendar.timegm((2024, 1, 1, 0, 0, 0)) + 3600.0)
+
+    def test_earliest_expiry_wins(self):
+        self.assertEqual(url_expiry('https://cdn.example.com/a.m3u8?expires=200&deadline=100'), 100.0)
+
+
+@override_settings(PLAY_URL_CACHE_ENABLED=True)
+class PlayUrlFreshnessTests(SimpleTestCase):
+    """When stored play URLs are reused, and which ones the refresher renews ahead of time."""
+
+    def setUp(self):
+        self.resolver = PlayUrlResolver(expiry_margin=300, unknown_ttl=300, track_interval=60)
+
+    @staticmethod
+    def episode(video_url, stored_ago=0):
+        return SimpleNamespace(video_url=video_url, last_synced=timezone.now() - timedelta(seconds=stored_ago))
+
+    def signed(self, expires_in):
+        return self.episode(f'https://cdn.example.com/a.m3u8?expires={int(time.time() + expires_in)}')
+
+    def test_signed_urls(self):
+        self.assertTrue(self.resolver.is_fresh(self.signed(1000)))
+        self.assertFalse(self.resolver.due_for_renewal(self.signed(1000), 900))
+        self.assertTrue(self.resolver.is_fresh(self.signed(600)))
+        self.assertTrue(self.resolver.due_for_renewal(self.signed(600), 900))
+        self.assertFalse(self.resolver.is_fresh(self.signed(200)))
+
+    def test_unknown_expiry_is_a_reuse_window(self):
+        url = 'https://cdn.example.com/a.m3u8'
+        self.assertTrue(self.resolver.is_fresh(self.episode(url, stored_ago=100)))
+        self.assertFalse(self.resolver.is_fresh(self.episode(url, stored_ago=400)))
+        for stored_ago in (100, 400):
+            self.assertFalse(self.resolver.due_for_renewal(self.episode(url, stored_ago), 900))
+
+    def test_missing_url(self):
+        self.assertFalse(self.resolver.is_fresh(self.episode('')))
+        self.assertTrue(self.resolver.due_for_renewal(self.episode(''), 900))
+
+
+class PruneRenditionsTests(SimpleTestCase):
+    """Variant limits and ordering applied to master playlists."""
+
+    MASTER = "\n".join([
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        "#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360",
+        "low.m3u8",
+        "#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080",
+        "high.m3u8",
+        "#EXT-X-STREAM-INF:BANDWIDTH=2000000,RESOLUTION=1280x720",
+        "mid.m3u8",
+    ])
+
+    @staticmethod
+    def variants(content):
+        return [line for line in content.splitlines() if not line.startswith('#')]
+
+    def test_unchanged_without_policy_or_variants(self):
+        self.assertEqual(prune_renditions(self.MASTER, None), self.MASTER)
+        media = "#EXTM3U\n#EXTINF:4,\nseg0.ts"
+        self.assertEqual(prune_renditions(media, RenditionPolicy(max_height=360)), media)
+
+    def test_limits(self):
+        pruned = prune_renditions(self.MASTER, RenditionPolicy(max_height=720))
+        self.assertEqual(self.variants(pruned), ['low.m3u8', 'mid.m3u8'])
+        self.assertTrue(pruned.startswith("#EXTM3U\n#EXT-X-VERSION:3\n"))
+        pruned = prune_renditions(self.MASTER, RenditionPolicy(max_bandwidth=1000000))
+        self.assertEqual(self.variants(pruned), ['low.m3u8'])
+
+    def test_lowest_kept_when_nothing_fits(self):
+        pruned = prune_renditions(self.MASTER, RenditionPolicy(max_height=144))
+        self.assertEqual(self.variants(pruned), ['low.m3u8'])
+
+    def test_order(self):
+        self.assertEqual(
+            self.variants(prune_renditions(self.MASTER, RenditionPolicy(order='desc'))),
+            ['high.m3u8', 'mid.m3u8', 'low.m3u8'],
+        )
+        self.assertEqual(
+            self.variants(prune_renditions(self.MASTER, RenditionPolicy(order='asc'))),
+            ['low.m3u8', 'mid.m3u8', 'high.m3u8'],
+        )
+
+
+class CompactRewriteTests(TestCase):
+    """Playlists rewritten to compact tokens that any worker can resolve."""
+
+    BASE_URL = 'https://cdn.example.com/v/index.m3u8'
+    PLAYLIST = "\n".join([
+        "#EXTM3U",
+        '#EXT-X-KEY:METHOD=AES-128,URI="key.bin"',
+        "#EXTINF:4,",
+        "seg0.ts",
+        "#EXTINF:4,",
+        "https://cdn2.example.com/seg1.ts",
+        "#EXT-X-ENDLIST",
+    ])
+
+    def setUp(self):
+        self.store = TokenStore(max_tables=10, ttl=60, purge_interval=300)
+        patcher = mock.patch.object(proxy, 'get_token_store', return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def tokens(content):
+        return re.findall(r'/api/proxy/(?:ts|m3u8)/([\w-]+\.\d+)', content)
+
+    def test_tokens_resolve_from_another_worker(self):
+        segments = []
+        content = proxy.rewrite_playlist(self.PLAYLIST, self.BASE_URL, segments)
+        self.assertNotIn('https://', content)
+        self.assertEqual(segments, ['https://cdn.example.com/v/seg0.ts', 'https://cdn2.example.com/seg1.ts'])
+
+        other_worker = TokenStore(max_tables=10, ttl=60, purge_interval=300)
+        self.assertEqual([other_worker.resolve(token) for token in self.tokens(content)], [
+            ('https://cdn.example.com/v/key.bin', 'key'),
+            ('https://cdn.example.com/v/seg0.ts', 'segment'),
+            ('https://cdn2.example.com/seg1.ts', 'segment'),
+        ])
+
+    def test_identical_playlists_share_a_table(self):
+        first = proxy.rewrite_playlist(self.PLAYLIST, self.BASE_URL)
+        self.assertEqual(proxy.rewrite_playlist(self.PLAYLIST, self.BASE_URL), first)
+        self.assertEqual(ProxyTokenTable.objects.count(), 1)
+
+    def test_unknown_and_expired_tokens(self):
+        content = proxy.rewrite_playlist(self.PLAYLIST, self.BASE_URL)
+        tid = self.tokens(content)[0].rsplit('.', 1)[0]
+        self.assertIsNone(self.store.resolve('nope'))
+        self.assertIsNone(self.store.resolve('unknown.0'))
+        self.assertIsNone(self.store.resolve(f'{tid}.99'))
+
+        ProxyTokenTable.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        other_worker = TokenStore(max_tables=10, ttl=60, purge_interval=300)
+        self.assertIsNone(other_worker.resolve(f'{tid}.0'))
+
+
+    def test_tables_are_extended_when_handed_out_late(self):
+        content = proxy.rewrite_playlist(self.PLAYLIST, self.BASE_URL)
+        proxy.rewrite_playlist(self.PLAYLIST, self.BASE_URL)
+        self.assertEqual(self.store.stats()['tablesSaved'], 1)
+
+        tid = self.tokens(content)[0].rsplit('.', 1)[0]
+        ProxyTokenTable.objects.update(expires_at=timezone.now() + timedelta(seconds=10))
+        other_worker = TokenStore(max_tables=10, ttl=60, purge_interval=300)
+        other_worker.resolve(f'{tid}.0')
+        # The local copy goes when the row does, not a full TTL after the lookup
+        self.assertLessEqual(other_worker.local._data[tid][1] - time.monotonic(), 10)
+
+        with mock.patch.object(proxy, 'get_token_store', return_value=other_worker):
+            proxy.rewrite_playlist(self.PLAYLIST, self.BASE_URL)
+        expires_at = ProxyTokenTable.objects.get(tid=tid).expires_at
+        self.assertGreater(expires_at, timezone.now() + timedelta(seconds=50))
+
+
+class DramaAdminCategoryTests(TestCase):
+    """Admin edits keep normalized categories and their counts in step with Drama.categories."""
+
+    def setUp(self):
+        self.admin = DramaAdmin(Drama, admin.site)
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        patcher = override_settings(SNAPSHOT_DIR=snapshot_dir.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def save(self, drama, **changes):
+        for name, value in changes.items():
+            setattr(drama, name, value)
+        drama.save()
+        self.admin.save_related(None, SimpleNamespace(instance=drama, save_m2m=lambda: None), [], True)
+
+    @staticmethod
+    def counts():
+        return dict(Category.objects.values_list('name', 'active_drama_count'))
+
+    def test_edits_resync_categories(self):
+        drama = Drama.objects.create(drama_id='d1', name='Bride')
+        self.save(drama, categories=['Romance'])
+        self.save(drama, categories=['Romance', 'Revenge'])
+        self.assertEqual({c.name for c in drama.normalized_categories.all()}, {'Romance', 'Revenge'})
+        self.assertEqual(self.counts(), {'Romance': 1, 'Revenge': 1})
+
+        self.save(drama, categories=['Revenge'], is_active=False)
+        self.assertEqual({c.name for c in drama.normalized_categories.all()}, {'Revenge'})
+        self.assertEqual(self.counts(), {'Romance': 0, 'Revenge': 0})
+
+    def test_delete_recounts(self):
+        drama = Drama.objects.create(drama_id='d1', name='Bride')
+        self.save(drama, categories=['Romance'])
+        self.admin.delete_model(None, drama)
+        self.assertEqual(self.counts(), {'Romance': 0})
+
+    def test_categories_are_read_only(self):
+        category_admin = CategoryAdmin(Category, admin.site)
+        self.assertFalse(category_admin.has_add_permission(None))
+        self.assertFalse(category_admin.has_change_permission(None))
+        self.assertFalse(category_admin.has_delete_permission(None))
+
+
+class CatalogSnapshotTests(TestCase):
+    """Snapshot files on disk while the catalog changes."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = override_settings(SNAPSHOT_DIR=self.directory)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        snapshot._meta_cache.update(mtime=None, meta=None, next_check=0.0)
+
+    def files(self):
+        return {name for name in os.listdir(self.directory) if name.startswith('catalog-')}
+
+    def build(self, name):
+        Drama.objects.create(drama_id=name, name=name)
+        CatalogState.bump()
+        return snapshot.build_snapshot()
+
+    def test_previous_snapshot_survives_one_rebuild(self):
+        first = set(self.build('a')['files'].values())
+        second = set(self.build('b')['files'].values())
+        self.assertEqual(self.files(), first | second)
+        third = set(self.build('c')['files'].values())
+        self.assertEqual(self.files(), second | third)
+
+    def test_stale_snapshot_is_served_while_rebuilding(self):
+        meta = self.build('a')
+        CatalogState.bump()
+        with mock.patch.object(snapshot, '_rebuild_in_background') as rebuild:
+            self.assertEqual(snapshot.current_snapshot(), meta)
+        rebuild.assert_called_once_with(meta['version'] + 1)
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages over the catalog order."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i, (name, views) in enumerate([
+            ('Alpha', 10), ('Bravo', 10), ('Same', 5), ('Same', 5), ('Charlie', 5), ('Delta', 0),
+        ]):
+            Drama.objects.create(drama_id=f'd{i}', name=name, views=views)
+
+    @staticmethod
+    def rows():
+        return Drama.objects.values('id', 'views', 'name')
+
+    def pages(self, limit):
+        ids, cursor = [], None
+        while True:
+            rows, cursor = keyset_page(self.rows(), cursor, limit)
+            ids.extend(row['id'] for row in rows)
+            if cursor is None:
+                return ids
+
+    def test_pages_cover_the_catalog_once_in_order(self):
+        expected = list(Drama.objects.order_by(*CATALOG_ORDER).values_list('id', flat=True))
+        for limit in (1, 2, 4, 10):
+            self.assertEqual(self.pages(limit), expected)
+
+    def test_rows_do_not_repeat_when_views_change(self):
+        first, cursor = keyset_page(self.rows(), None, 2)
+        Drama.objects.filter(drama_id='d5').update(views=100)
+        second, _ = keyset_page(self.rows(), cursor, 10)
+        seen = {row['id'] for row in first}
+        self.assertFalse(seen & {row['id'] for row in second})
+
+    def test_cursors(self):
+        self.assertEqual(decode_cursor(encode_cursor({'views': 3, 'name': 'x', 'id': 7})), (3, 'x', 7))
+        for cursor in ('garbage', encode_cursor({'views': 'a', 'name': 'x', 'id': 7})):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class SearchIndexTests(SimpleTestCase):
+    """Ranking and matching of the in-process search index."""
+
+    DRAMAS = [
+        (1, 'The Billionaire Bride', ['Romance'], 'A contract marriage', 10),
+        (2, 'Revenge of the Bride', ['Revenge'], 'She returns', 50),
+        (3, 'Hidden Heir', ['Romance'], 'A billionaire in disguise', 100),
+    ]
+
+    def setUp(self):
+        self.index = SearchIndex(check_interval=3600, fuzzy_threshold=0.4)
+        self.index._next_check = float('inf')
+        for pk, name, categories, description, views in self.DRAMAS:
+            self.index._add(SimpleNamespace(
+                pk=pk, name=name, categories=categories, description=description, views=views,
+            ))
+        self.index.vocab = sorted(self.index.postings)
+
+    def test_exact_words_rank_by_views(self):
+        self.assertEqual(self.index.search('BRIDE'), [2, 1])
+
+    def test_name_outranks_description(self):
+        self.assertEqual(self.index.search('billionaire'), [1, 3])
+
+    def test_prefix_and_typo(self):
+        self.assertEqual(self.index.search('bill'), [1, 3])
+        self.assertEqual(self.index.search('bilionaire'), [1, 3])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.index.search('billionaire bride'), [1])
+        self.assertEqual(self.index.search('bride heir'), [])
+
+    def test_name_prefix_bonus(self):
+        self.assertEqual(self.index.search('the'), [1, 2])
+
+    def test_category_filter(self):
+        self.assertEqual(self.index.search('bride', category='Romance'), [1])
+
+    def test_removed_drama(self):
+        self.index._remove(1)
+        self.assertEqual(self.index.search('bride'), [2])
+        self.assertEqual(self.index.search('billionaire'), [3])
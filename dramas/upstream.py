@@ -0,0 +1,462 @@
+"""
+Shared upstream HTTP client for all nanodrama traffic.
+
+One keep-alive connection pool per process (requests) and per event loop
+(aiohttp), per-host connection limits, DNS caching on the async side,
+consistent connect/read deadlines and precomputed header templates.
+JoliboxService, the proxy views, the prefetcher and ReliableDramaSyncService
+all go through here.
+
+Segment fetches additionally go through a per-host circuit breaker and,
+optionally, hedged requests (fetch_segment / afetch_segment).
+"""
+import asyncio
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .metrics import observe_upstream
+
+BASE_URL = "https://www.nanodrama.com/api"
+
+# Fake headers to look like a browser
+PLAYLIST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Referer": "https://www.nanodrama.com/",
+    "Origin": "https://www.nanodrama.com"
+}
+
+SEGMENT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Referer": "https://www.nanodrama.com/",
+}
+
+API_HEADERS = {
+    "accept": "application/json, text/plain, */*",
+    "accept-language": "en",
+    "referer": "https://www.nanodrama.com/",
+    "sec-ch-ua": '"Google Chrome";v="143", "Chromium";v="143", "Not A(Brand";v="24"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"',
+    "sec-fetch-dest": "empty",
+    "sec-fetch-mode": "cors",
+    "sec-fetch-site": "same-origin",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/143.0.0.0 Safari/537.36",
+    "x-joli-accept-language": "en",
+    "x-os-type": "ANDROID",
+    "x-runtime-type": "WEB",
+}
+
+
+# ----------------------------------------------------------------------
+# Header templates
+# ----------------------------------------------------------------------
+
+# (token, device_id) -> (list headers, drama headers)
+_api_templates = {}
+
+
+def api_headers(config, drama_id: str = None, episode_num: int = None) -> dict:
+    """
+    Request headers for the nanodrama API, built from templates precomputed
+    per JoliboxConfig. The returned dict may be shared - don't mutate it.
+    """
+    key = (config.joli_source_token, config.device_id)
+    templates = _api_templates.get(key)
+    if templates is None:
+        base = {**API_HEADERS, "x-joli-source": config.joli_source_token}
+        # Add user agent for detail/unlock endpoints
+        drama = {
+            **base,
+            "x-user-agent": f"JoliboxMinidramaWeb (PC; undefined; 10; en) uuid/{config.device_id} adid/ version/2.4.0",
+        }
+        templates = _api_templates[key] = (base, drama)
+
+    if not drama_id:
+        return templates[0]
+    if episode_num:
+        return {**templates[1], "referer": f"https://www.nanodrama.com/drama/{drama_id}/{episode_num}"}
+    return templates[1]
+
+
+# ----------------------------------------------------------------------
+# Deadlines
+# ----------------------------------------------------------------------
+
+def api_timeout() -> tuple:
+    """(connect, read) deadline for API calls."""
+    return settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_API_TIMEOUT
+
+
+def media_timeout() -> tuple:
+    """(connect, read) deadline for playlists, segments, keys."""
+    return settings.UPSTREAM_CONNECT_TIMEOUT, settings.PROXY_TIMEOUT
+
+
+def async_api_timeout() -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(
+        total=None,
+        sock_connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+        sock_read=settings.UPSTREAM_API_TIMEOUT,
+    )
+
+
+def async_media_timeout() -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(
+        total=None,
+        sock_connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+        sock_read=settings.PROXY_TIMEOUT,
+    )
+
+
+# ----------------------------------------------------------------------
+# Sessions
+# ----------------------------------------------------------------------
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Process-wide requests session with a keep-alive pool per upstream host."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.UPSTREAM_POOL_HOSTS,
+                    pool_maxsize=settings.UPSTREAM_POOL_PER_HOST,
+                    # Beyond pool_maxsize extra connections are opened and discarded
+                    # rather than waiting (forever) for a slot
+                    pool_block=False,
+                    max_retries=0,
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                # Stateless like the bare requests.get() calls it replaces
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                _session = session
+    return _session
+
+
+# One aiohttp session per event loop
+_async_sessions = weakref.WeakKeyDictionary()
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    """aiohttp session bound to the running event loop."""
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=settings.PROXY_MAX_CONNECTIONS,
+                limit_per_host=settings.UPSTREAM_ASYNC_PER_HOST,
+                ttl_dns_cache=settings.UPSTREAM_DNS_CACHE_TTL,
+            ),
+            timeout=async_media_timeout(),
+        )
+        _async_sessions[loop] = session
+    return session
+
+
+
+# ----------------------------------------------------------------------
+# Host health: latency tracking, circuit breaker, hedged segment fetches
+# ----------------------------------------------------------------------
+
+class CircuitOpenError(Exception):
+    """The upstream host's breaker is open, the request was not attempted."""
+
+    def __init__(self, host):
+        super().__init__(f"Upstream {host} is unhealthy, failing fast")
+        self.host = host
+
+
+class HostHealth:
+    """
+    Time-to-first-byte samples and a circuit breaker for one upstream host.
+    closed -> open after UPSTREAM_BREAKER_FAILURES consecutive failures,
+    open -> half-open after UPSTREAM_BREAKER_COOLDOWN, where one probe
+    request decides between closed and open again. A probe that never
+    reports back (cancelled, stuck) stops blocking the next one after
+    UPSTREAM_BREAKER_PROBE_TIMEOUT.
+    """
+
+    def __init__(self):
+        self.latencies = deque(maxlen=settings.UPSTREAM_LATENCY_WINDOW)
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < settings.UPSTREAM_BREAKER_COOLDOWN:
+                    return False
+                self.state = 'half_open'
+            if self.probing and time.monotonic() - self.probe_started < settings.UPSTREAM_BREAKER_PROBE_TIMEOUT:
+                return False
+            self.probing = True
+            self.probe_started = time.monotonic()
+            return True
+
+    def release_probe(self):
+        """The request let through by allow() ended without a verdict on the host."""
+        with self._lock:
+            self.probing = False
+
+    def record_success(self, ttfb: float):
+        with self._lock:
+            self.latencies.append(ttfb)
+            self.failures = 0
+            self.probing = False
+            self.state = 'closed'
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == 'half_open' or (
+                self.state == 'closed' and self.failures >= settings.UPSTREAM_BREAKER_FAILURES
+            ):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                _count('trips')
+
+    def p95(self):
+        """95th percentile time to first byte, or None until we have enough samples."""
+        with self._lock:
+            if len(self.latencies) < settings.UPSTREAM_HEDGE_MIN_SAMPLES:
+                return None
+            samples = sorted(self.latencies)
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def hedge_delay(self):
+        """How long to wait for the first byte before firing a hedge, or None to not hedge."""
+        if not settings.UPSTREAM_HEDGING_ENABLED:
+            return None
+        p95 = self.p95()
+        return max(p95, settings.UPSTREAM_HEDGE_MIN_DELAY) if p95 is not None else None
+
+    def stats(self) -> dict:
+        p95 = self.p95()
+        return {
+            "state": self.state,
+            "consecutiveFailures": self.failures,
+            "p95Ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "samples": len(self.latencies),
+        }
+
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+_counters = {'trips': 0, 'rejected': 0, 'hedges_fired': 0, 'hedges_won': 0}
+_counters_lock = threading.Lock()
+_hedge_pool = None
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def host_health(url: str) -> HostHealth:
+    host = urlsplit(url).netloc
+    health = _hosts.get(host)
+    if health is None:
+        with _hosts_lock:
+            health = _hosts.setdefault(host, HostHealth())
+    return health
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _hosts_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(
+                    max_workers=settings.UPSTREAM_HEDGE_WORKERS, thread_name_prefix='hedge'
+                )
+    return _hedge_pool
+
+
+def _timed_get(url, headers, health):
+    """GET until the response headers arrive, feeding the host's health."""
+    started = time.monotonic()
+    try:
+        resp = get_session().get(url, headers=headers, stream=True, timeout=media_timeout())
+    except Exception:
+        health.record_failure()
+        observe_upstream('segment', 'error')
+        raise
+    ttfb = time.monotonic() - started
+    observe_upstream('segment', resp.status_code, ttfb)
+    if resp.status_code >= 500:
+        health.record_failure()
+    else:
+        health.record_success(ttfb)
+    return resp
+
+
+def _start_thread(fn, *args) -> Future:
+    """Run fn(*args) on a thread of its own, started now; its outcome lands in the returned future."""
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='segment-fetch', daemon=True).start()
+    return future
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def fetch_segment(url: str, headers: dict, hedge: bool = True) -> requests.Response:
+    """
+    Streamed GET of a segment through the host's circuit breaker.
+    If hedging is on and the first byte hasn't arrived within the host's p95,
+    a second request is fired; whichever answers first wins and the other
+    one is closed. Raises CircuitOpenError while the host is unhealthy.
+
+    The caller has to stay free to take the hedge's answer, so the first
+    request runs on a thread of its own, started right away - it never
+    queues behind the hedge pool, and the delay is measured from when it
+    actually went out. Only hedges use the pool.
+    """
+    health = host_health(url)
+    if not health.allow():
+        _count('rejected')
+        raise CircuitOpenError(urlsplit(url).netloc)
+
+    delay = health.hedge_delay() if hedge else None
+    if delay is None:
+        return _timed_get(url, headers, health)
+
+    first = _start_thread(_timed_get, url, headers, health)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    _count('hedges_fired')
+    second = _get_hedge_pool().submit(_timed_get, url, headers, health)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        succeeded = [f for f in done if f.exception() is None]
+        if not succeeded:
+            error = next(iter(done)).exception()
+            continue
+        winner = second if second in succeeded else first
+        # Both may have answered at once; every response but the winner goes back to the pool
+        for loser in [f for f in succeeded if f is not winner] + list(pending):
+            loser.add_done_callback(_close_response)
+        if winner is second:
+            _count('hedges_won')
+        return winner.result()
+    raise error
+
+
+async def _atimed_get(url, headers, health):
+    started = time.monotonic()
+    try:
+        resp = await get_async_session().get(url, headers=headers)
+    except asyncio.CancelledError:
+        # A lost hedge or a client that went away says nothing about the host
+        health.release_probe()
+        raise
+    except Exception:
+        health.record_failure()
+        observe_upstream('segment', 'error')
+        raise
+    ttfb = time.monotonic() - started
+    observe_upstream('segment', resp.status, ttfb)
+    if resp.status >= 500:
+        health.record_failure()
+    else:
+        health.record_success(ttfb)
+    return resp
+
+
+def _release_response(task):
+    if not task.cancelled() and task.exception() is None:
+        task.result().release()
+
+
+async def afetch_segment(url: str, headers: dict, hedge: bool = True) -> aiohttp.ClientResponse:
+    """Async version of fetch_segment(); the losing request is cancelled."""
+    health = host_health(url)
+    if not health.allow():
+        _count('rejected')
+        raise CircuitOpenError(urlsplit(url).netloc)
+
+    delay = health.hedge_delay() if hedge else None
+    if delay is None:
+        return await _atimed_get(url, headers, health)
+
+    first = asyncio.ensure_future(_atimed_get(url, headers, health))
+    # Tasks to cancel and release on the way out - never the one being returned
+    losers = {first}
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            losers = set()
+            return first.result()
+
+        _count('hedges_fired')
+        second = asyncio.ensure_future(_atimed_get(url, headers, health))
+        pending = losers = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [t for t in done if t.exception() is None]
+            if not succeeded:
+                error = next(iter(done)).exception()
+                continue
+            winner = second if second in succeeded else first
+            losers = {first, second} - {winner}
+            if winner is second:
+                _count('hedges_won')
+            return winner.result()
+        raise error
+    finally:
+        for task in losers:
+            task.cancel()
+            task.add_done_callback(_release_response)
+
+
+def upstream_stats() -> dict:
+    """Breaker/hedging counters and per-host health for this worker."""
+    with _counters_lock:
+        counters = dict(_counters)
+    return {
+        "breakerTrips": counters['trips'],
+        "rejected": counters['rejected'],
+        "hedgesFired": counters['hedges_fired'],
+        "hedgesWon": counters['hedges_won'],
+        "hosts": {host: health.stats() for host, health in list(_hosts.items())},
+    }
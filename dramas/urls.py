@@ -1,6 +1,15 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.PROXY_MODE == 'async':
+    from . import async_views
+    proxy_m3u8_view = async_views.AsyncProxyM3U8View.as_view()
+    proxy_ts_view = async_views.AsyncProxyStreamView.as_view()
+else:
+    proxy_m3u8_view = views.ProxyM3U8View.as_view()
+    proxy_ts_view = views.ProxyStreamView.as_view()
+
 urlpatterns = [
     # Original API endpoints (call NanoDrama API directly)
     path('dramas/', views.DramaListView.as_view(), name='drama-list'),
@@ -9,11 +18,18 @@ urlpatterns = [
     path('dramas/<str:drama_id>/unlock/<int:episode_num>/', views.UnlockEpisodeView.as_view(), name='unlock-episode'),
     
     # Proxy endpoints for CORS handling
-    path('proxy/m3u8/', views.ProxyM3U8View.as_view(), name='proxy-m3u8'),
-    path('proxy/ts/', views.ProxyStreamView.as_view(), name='proxy-ts'),
+    path('proxy/m3u8/', proxy_m3u8_view, name='proxy-m3u8'),
+    path('proxy/ts/', proxy_ts_view, name='proxy-ts'),
+    path('proxy/m3u8/<str:token>', proxy_m3u8_view, name='proxy-m3u8-token'),
+    path('proxy/ts/<str:token>', proxy_ts_view, name='proxy-ts-token'),
+    path('proxy/stats/', views.ProxyStatsView.as_view(), name='proxy-stats'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
     
     # Cached endpoints (serve from local database - no API calls)
     path('cached/dramas/', views.CachedDramaListView.as_view(), name='cached-drama-list'),
+    path('cached/catalog/', views.CachedCatalogSnapshotView.as_view(), name='cached-catalog-snapshot'),
+    path('cached/categories/', views.CachedCategoryListView.as_view(), name='cached-category-list'),
     path('cached/dramas/<str:drama_id>/', views.CachedDramaDetailView.as_view(), name='cached-drama-detail'),
+    path('cached/dramas/<str:drama_id>/episodes/play/', views.CachedEpisodeBatchPlayView.as_view(), name='cached-episode-batch-play'),
     path('cached/dramas/<str:drama_id>/episodes/<int:episode_num>/play/', views.CachedEpisodePlayView.as_view(), name='cached-episode-play'),
 ]
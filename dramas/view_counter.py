@@ -0,0 +1,112 @@
+"""
+Write-buffered Drama.views counting.
+
+Plays only bump an in-memory per-drama counter. A background thread folds the
+buffer into the database every VIEW_COUNT_FLUSH_INTERVAL seconds with a single
+UPDATE ... SET views = views + CASE id WHEN ... END, so a popular drama's row
+is written once per interval per worker instead of once per play. The buffer
+is flushed again when the worker exits, and counts from a failed flush go
+back into the buffer for the next one.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import Drama
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """Per-worker buffer of drama play counts, flushed in batches."""
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.pending = Counter()
+        self.pid = os.getpid()
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+        self.recorded = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def record(self, drama_pk):
+        with self._lock:
+            self.pending[drama_pk] += 1
+            self.recorded += 1
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write buffered counts in one UPDATE; on failure they're kept for the next flush."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self.pending = self.pending, Counter()
+            if not batch:
+                return
+            try:
+                Drama.objects.filter(pk__in=batch.keys()).update(
+                    views=F('views') + Case(
+                        *(When(pk=pk, then=Value(count)) for pk, count in batch.items()),
+                        default=Value(0),
+                        output_field=IntegerField(),
+                    )
+                )
+            except Exception as e:
+                logger.warning(f"View count flush failed, retrying later: {e}")
+                with self._lock:
+                    self.pending.update(batch)
+                    self.failures += 1
+                return
+            finally:
+                if threading.current_thread() is self._thread:
+                    connection.close()
+            with self._lock:
+                self.flushed += sum(batch.values())
+                self.flushes += 1
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "recorded": self.recorded,
+                "pending": sum(self.pending.values()),
+                "flushed": self.flushed,
+                "flushes": self.flushes,
+                "failures": self.failures,
+            }
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def get_view_counter():
+    """Get this worker's view counter, or None when view counting is off."""
+    global _counter
+    if not settings.VIEW_COUNT_ENABLED:
+        return None
+    if _counter is None or _counter.pid != os.getpid():
+        # (re)created after a fork, the flusher thread doesn't survive it
+        with _counter_lock:
+            if _counter is None or _counter.pid != os.getpid():
+                _counter = ViewCounter(settings.VIEW_COUNT_FLUSH_INTERVAL)
+    return _counter
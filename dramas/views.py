@@ -1,22 +1,55 @@
 
-import requests
-from django.http import StreamingHttpResponse, HttpResponse
-from urllib.parse import quote, unquote, urljoin
+import os
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse, HttpResponse
+from urllib.parse import quote
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .services import JoliboxService
-from .models import Drama, Episode
+from .services import JoliboxService, service_cache_stats
+from .models import Category, Drama, Episode
+from .proxy import (
+    PLAYLIST_CONTENT_TYPE, SMALL_OBJECT_KINDS, UpstreamStream,
+    accel_redirect_response, cached_segment_response, copy_segment_headers,
+    prune_renditions, rendition_policy, rewrite_playlist, small_object_response,
+    start_segment_fill, upstream_host_allowed, upstream_segment_headers,
+)
+from .metrics import collect, observe_upstream, render_prometheus
+from .object_cache import get_object_cache
+from .pagination import (
+    CATALOG_ORDER, approximate_count, decode_offset_cursor, encode_offset_cursor, keyset_page, ranked_page,
+)
+from .play_urls import get_play_url_resolver
+from .playlist_cache import get_playlist_cache
+from .prefetch import get_prefetcher
+from .proxy_tokens import get_token_store, resolve_token
+from .response_cache import cached_response, get_response_cache
+from .search import get_search_index
+from .segment_cache import get_segment_cache
+from .serializers import drama_list_item, drama_rows, parse_drama_fields
+from .snapshot import choose_encoding, current_snapshot, snapshot_path
+from .upstream import (
+    PLAYLIST_HEADERS, SEGMENT_HEADERS, CircuitOpenError, fetch_segment, get_session, media_timeout,
+    upstream_stats,
+)
+from .view_counter import get_view_counter
 
 class ProxyM3U8View(APIView):
     """
     Proxy for M3U8 playlists to handle CORS and rewrites.
+    Rewritten playlists are cached until their token expires (playlist_cache.py).
     """
     authentication_classes = []
     permission_classes = []
 
-    def get(self, request):
-        target_url = request.query_params.get('url')
+    def get(self, request, token=None):
+        if token:
+            target = resolve_token(token)
+            if target is None:
+                return Response({"error": "Unknown or expired proxy token"}, status=404)
+            target_url = target[0]
+        else:
+            target_url = request.query_params.get('url')
         if not target_url:
             return Response({"error": "Missing url parameter"}, status=400)
         
@@ -24,85 +57,178 @@ class ProxyM3U8View(APIView):
         # target_url = unquote(target_url) 
 
         try:
-            # Fake headers to look like a browser
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Referer": "https://www.nanodrama.com/",
-                "Origin": "https://www.nanodrama.com"
-            }
-            
-            resp = requests.get(target_url, headers=headers, allow_redirects=True)
-            resp.raise_for_status()
-            
-            base_url = resp.url
-            content = resp.text
-            new_lines = []
-            
-            # Use root-relative paths to avoid Host header/Port stripping issues
-            # This ensures the browser resolves valid URLs against the current page origin
-            proxy_m3u8 = "/api/proxy/m3u8/?url="
-            proxy_ts = "/api/proxy/ts/?url="
+            policy = rendition_policy(request.query_params)
+            cache = get_playlist_cache()
+            if cache:
+                new_content = cache.get_or_fetch(
+                    target_url, lambda: self._fetch(target_url, policy), variant=policy.key if policy else ''
+                )
+            else:
+                new_content, _ = self._fetch(target_url, policy)
 
-            
-            for line in content.splitlines():
-                if line.strip().startswith('#') or not line.strip():
-                    new_lines.append(line)
-                    continue
-                
-                # It's a URL
-                original_segment_url = line.strip()
-                absolute_url = urljoin(base_url, original_segment_url)
-                encoded_url = quote(absolute_url)
-                
-                # Check if it's a playlist or a segment
-                if '.m3u8' in absolute_url or 'm3u8' in absolute_url.split('?')[0]:
-                    new_lines.append(f"{proxy_m3u8}{encoded_url}")
-                else:
-                    new_lines.append(f"{proxy_ts}{encoded_url}")
-            
-            new_content = "\n".join(new_lines)
+            prefetcher = get_prefetcher()
+            if prefetcher:
+                prefetcher.on_playlist(target_url)
             
             return HttpResponse(
                 new_content,
-                content_type="application/vnd.apple.mpegurl",
+                content_type=PLAYLIST_CONTENT_TYPE,
                 headers={"Access-Control-Allow-Origin": "*"}
             )
             
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
+    @staticmethod
+    def _fetch(target_url, policy=None):
+        """Fetch, prune and rewrite the playlist. Returns (rewritten_text, final_url)."""
+        try:
+            resp = get_session().get(target_url, headers=PLAYLIST_HEADERS, timeout=media_timeout())
+        except Exception:
+            observe_upstream('playlist', 'error')
+            raise
+        # requests' elapsed stops when the response headers are parsed
+        observe_upstream('playlist', resp.status_code, resp.elapsed.total_seconds())
+        resp.raise_for_status()
+        segments = []
+        new_content = rewrite_playlist(prune_renditions(resp.text, policy), resp.url, segments)
+        prefetcher = get_prefetcher()
+        if prefetcher:
+            prefetcher.register(target_url, segments)
+        return new_content, resp.url
+
 class ProxyStreamView(APIView):
     """
     Proxy for video segments (TS) or other binary content.
+    Complete segments are kept in the disk cache (segment_cache.py) and
+    later requests are served from there. Range/If-Range are honoured on
+    cache hits and forwarded upstream on misses.
+    With PROXY_SEGMENT_DELIVERY = 'accel' the bytes are left to nginx.
+    AES keys and init segments (kind=key/init) are cached in memory.
     """
     authentication_classes = []
     permission_classes = []
 
-    def get(self, request):
-        target_url = request.query_params.get('url')
+    def get(self, request, token=None):
+        if token:
+            target = resolve_token(token)
+            if target is None:
+                return Response({"error": "Unknown or expired proxy token"}, status=404)
+            target_url, kind = target
+        else:
+            target_url, kind = request.query_params.get('url'), request.query_params.get('kind')
         if not target_url:
             return Response({"error": "Missing url parameter"}, status=400)
+
+        if kind in SMALL_OBJECT_KINDS and not request.headers.get('Range'):
+            return self._small_object(target_url)
+
+        prefetcher = get_prefetcher()
+        if prefetcher:
+            prefetcher.on_segment(target_url)
+
+        cache = get_segment_cache()
+        if settings.PROXY_SEGMENT_DELIVERY == 'accel':
+            # nginx fetches/serves the bytes, we only validate and redirect
+            if not upstream_host_allowed(target_url):
+                return Response({"error": "Upstream host not allowed"}, status=403)
+            return accel_redirect_response(target_url, cache)
+
+        if cache:
+            segment = cache.lookup(target_url)
+            if segment:
+                response = cached_segment_response(segment, request)
+                if response:
+                    return response
             
         try:
-             # Fake headers
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Referer": "https://www.nanodrama.com/",
-            }
-            
-            resp = requests.get(target_url, headers=headers, stream=True, timeout=10)
+            resp = fetch_segment(target_url, upstream_segment_headers(request))
+            if resp.status_code == 416:
+                resp.close()
+                response = HttpResponse(status=416)
+                copy_segment_headers(response, resp.headers)
+                response['Access-Control-Allow-Origin'] = '*'
+                return response
             resp.raise_for_status()
+
+            # Only complete objects go into the cache, never a 206 slice
+            writer = start_segment_fill(cache, target_url, resp.headers) if resp.status_code == 200 else None
             
             response = StreamingHttpResponse(
-                resp.iter_content(chunk_size=8192),
+                UpstreamStream(resp, writer),
+                status=resp.status_code,
                 content_type=resp.headers.get('Content-Type', 'application/octet-stream')
             )
+            copy_segment_headers(response, resp.headers)
             response['Access-Control-Allow-Origin'] = '*'
             return response
             
+        except CircuitOpenError as e:
+            return Response({"error": str(e)}, status=503, headers={'Retry-After': str(settings.UPSTREAM_BREAKER_COOLDOWN)})
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
+    @staticmethod
+    def _small_object(target_url):
+        """AES keys and init segments: fetched whole and served from memory afterwards."""
+        cache = get_object_cache()
+        item = cache.get(target_url) if cache else None
+        if item:
+            return small_object_response(*item, cache_status='HIT')
+
+        try:
+            resp = get_session().get(target_url, headers=SEGMENT_HEADERS, timeout=media_timeout())
+            resp.raise_for_status()
+        except Exception as e:
+            return Response({"error": str(e)}, status=500)
+
+        content_type = resp.headers.get('Content-Type', 'application/octet-stream')
+        if cache:
+            cache.put(target_url, resp.content, content_type)
+        return small_object_response(resp.content, content_type, cache_status='MISS')
+
+
+class ProxyStatsView(APIView):
+    """Per-worker proxy statistics (cache hit ratios, bytes saved)."""
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        segment_cache = get_segment_cache()
+        playlist_cache = get_playlist_cache()
+        prefetcher = get_prefetcher()
+        object_cache = get_object_cache()
+        token_store = get_token_store()
+        view_counter = get_view_counter()
+        search_index = get_search_index()
+        response_cache = get_response_cache()
+        return Response({
+            "pid": os.getpid(),
+            "segmentCache": segment_cache.stats() if segment_cache else None,
+            "playlistCache": playlist_cache.stats() if playlist_cache else None,
+            "prefetch": prefetcher.stats() if prefetcher else None,
+            "objectCache": object_cache.stats() if object_cache else None,
+            "upstream": upstream_stats(),
+            "proxyTokens": token_store.stats() if token_store else None,
+            "playUrls": get_play_url_resolver().stats(),
+            "viewCounter": view_counter.stats() if view_counter else None,
+            "searchIndex": search_index.stats() if search_index else None,
+            "responseCache": response_cache.stats() if response_cache else None,
+            "joliboxCache": service_cache_stats(),
+        })
+
+
+class MetricsView(APIView):
+    """Proxy metrics of all workers in the Prometheus text format."""
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        return HttpResponse(
+            render_prometheus(collect()),
+            content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
 
 class DramaListView(APIView):
     """API view to list all available dramas."""
@@ -196,6 +322,7 @@ class UnlockEpisodeView(APIView):
 class CachedDramaListView(APIView):
     """API view to list all cached dramas from local database."""
     
+    @cached_response('drama-list', params=('limit', 'offset', 'cursor', 'total', 'category', 'search', 'fields'))
     def get(self, request):
         """
         Get list of cached dramas.
@@ -203,40 +330,68 @@ class CachedDramaListView(APIView):
         Query params:
         - limit: Max items to return (default: 100)
         - offset: Pagination offset (default: 0)
+        - cursor: Keyset pagination instead of offset; empty for the first page,
+          then the `next` value of the previous page
+        - total: With cursor, `approx` (default) for a cached count or `none`
         - category: Filter by category
-        - search: Search by name
+        - search: Search name, categories and description (ranked, typo tolerant)
+        - fields: Comma separated fields and/or presets to return
+          (`card` = dramaId,name,cover; `full` = everything, the default)
         """
         limit = int(request.query_params.get('limit', 100))
         offset = int(request.query_params.get('offset', 0))
+        cursor = request.query_params.get('cursor')
         category = request.query_params.get('category')
         search = request.query_params.get('search')
+        index = get_search_index() if search else None
         
         queryset = Drama.objects.filter(is_active=True)
         
         if category:
-            queryset = queryset.filter(categories__contains=[category])
+            # Through the indexed category table rather than a JSON containment scan
+            queryset = queryset.filter(normalized_categories__name=category)
         
-        if search:
+        if search and not index:
             queryset = queryset.filter(name__icontains=search)
         
-        total = queryset.count()
-        dramas = queryset[offset:offset + limit]
+        next_cursor = None
+        try:
+            fields = parse_drama_fields(request.query_params.get('fields'))
+            rows = drama_rows(queryset, fields)
+            if index:
+                # Search results are ranked in memory; their cursor carries a position
+                start = offset if cursor is None else (decode_offset_cursor(cursor) if cursor else 0)
+                ranked = index.search(search, category)
+                total = len(ranked)
+                dramas = ranked_page(rows, ranked, start, limit)
+                if cursor is not None and start + limit < total:
+                    next_cursor = encode_offset_cursor(start + limit)
+            elif cursor is not None:
+                dramas, next_cursor = keyset_page(rows, cursor, max(limit, 1))
+                total = None
+                if request.query_params.get('total', 'approx') != 'none':
+                    total = approximate_count(queryset, (category, search))
+            else:
+                total = queryset.count()
+                dramas = rows.order_by(*CATALOG_ORDER)[offset:offset + limit]
+        except ValueError as e:
+            return Response(
+                {"code": "ERROR", "message": str(e), "data": []},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        data = []
-        for drama in dramas:
-            data.append({
-                "dramaId": drama.drama_id,
-                "name": drama.name,
-                "description": drama.description,
-                "cover": drama.cover_url,
-                "logo": drama.logo_url,
-                "episodeCount": drama.episode_count,
-                "orientation": drama.orientation,
-                "categories": drama.categories,
-                "views": drama.views,
-                "syncedEpisodes": drama.episodes.filter(is_unlocked=True).count(),
-            })
+        data = [drama_list_item(row, fields) for row in dramas]
         
+        if cursor is not None:
+            return Response({
+                "code": "SUCCESS",
+                "message": "success",
+                "data": data,
+                "total": total,
+                "limit": limit,
+                "next": next_cursor,
+            })
+
         return Response({
             "code": "SUCCESS",
             "message": "success",
@@ -247,11 +402,83 @@ class CachedDramaListView(APIView):
         })
 
 
+class CachedCategoryListView(APIView):
+    """API view to list categories with their number of active dramas."""
+
+    @cached_response('category-list')
+    def get(self, request):
+        """Get categories that have active dramas, largest first (counts are kept up to date by sync)."""
+        categories = Category.objects.filter(active_drama_count__gt=0).values_list('name', 'active_drama_count')
+        return Response({
+            "code": "SUCCESS",
+            "message": "success",
+            "data": [{"name": name, "count": count} for name, count in categories],
+        })
+
+
+class CachedCatalogSnapshotView(APIView):
+    """API view serving the whole cached catalog as one precompressed snapshot (rebuilt by each sync)."""
+
+    def get(self, request):
+        """Serve the snapshot in the best encoding the client accepts, or 304 if its ETag still matches."""
+        snapshot = current_snapshot()
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'), snapshot['files'])
+        # Each content-coding is a different representation with its own tag
+        etag = snapshot['etags'][encoding]
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        if etag in tags or '*' in tags:
+            response = HttpResponse(status=304)
+        else:
+            try:
+                f = open(snapshot_path(snapshot['files'][encoding]), 'rb')
+            except FileNotFoundError:
+                # Replaced by a newer snapshot between reading meta and opening
+                return Response({"error": "Catalog snapshot is being rebuilt"}, status=503, headers={'Retry-After': '1'})
+            response = FileResponse(f, content_type='application/json')
+            if 'Content-Disposition' in response:
+                del response['Content-Disposition']
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = settings.SNAPSHOT_CACHE_CONTROL
+        response['X-Catalog-Version'] = str(snapshot['version'])
+        return response
+
+
 class CachedDramaDetailView(APIView):
     """API view to get cached drama details from local database."""
     
+    @cached_response('drama-detail', params=('from', 'count', 'episodes'))
     def get(self, request, drama_id):
-        """Get details for a specific cached drama."""
+        """
+        Get details for a specific cached drama.
+
+        Query params:
+        - from: First episode number to include (default: 1)
+        - count: Number of episodes to include (default: all from `from` on)
+        - episodes: `full` (default) for one object per episode, or `compact`
+          for just the unlocked episode numbers - fetch URLs from the play endpoints
+        """
+        try:
+            start = int(request.query_params.get('from', 1))
+            count = request.query_params.get('count')
+            count = int(count) if count is not None else None
+        except ValueError:
+            return Response(
+                {"code": "ERROR", "message": "from and count must be integers", "data": None},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        mode = request.query_params.get('episodes', 'full')
+        if mode not in ('full', 'compact'):
+            return Response(
+                {"code": "ERROR", "message": "episodes must be full or compact", "data": None},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         try:
             drama = Drama.objects.get(drama_id=drama_id)
         except Drama.DoesNotExist:
@@ -259,37 +486,49 @@ class CachedDramaDetailView(APIView):
                 {"code": "ERROR", "message": "Drama not found in cache", "data": None},
                 status=status.HTTP_404_NOT_FOUND
             )
-        
-        episodes = []
-        for ep in drama.episodes.all():
-            episodes.append({
-                "episodeNumber": ep.episode_number,
-                "videoUrl": ep.video_url,
-                "isUnlocked": ep.is_unlocked,
-                "lastSynced": ep.last_synced.isoformat() if ep.last_synced else None,
-            })
-        
+
+        window = drama.episodes.filter(episode_number__gte=start).order_by('episode_number')
+        if count is not None:
+            window = window.filter(episode_number__lt=start + max(count, 0))
+
+        data = {
+            "dramaId": drama.drama_id,
+            "name": drama.name,
+            "description": drama.description,
+            "cover": drama.cover_url,
+            "logo": drama.logo_url,
+            "episodeCount": drama.episode_count,
+            "orientation": drama.orientation,
+            "categories": drama.categories,
+            "views": drama.views,
+            "lastSynced": drama.last_synced.isoformat() if drama.last_synced else None,
+        }
+        if mode == 'compact':
+            data["unlockedEpisodes"] = list(
+                window.filter(is_unlocked=True).values_list('episode_number', flat=True)
+            )
+        else:
+            data["episodes"] = [
+                {
+                    "episodeNumber": number,
+                    "videoUrl": video_url,
+                    "isUnlocked": is_unlocked,
+                    "lastSynced": last_synced.isoformat() if last_synced else None,
+                }
+                for number, video_url, is_unlocked, last_synced in window.values_list(
+                    'episode_number', 'video_url', 'is_unlocked', 'last_synced'
+                )
+            ]
+
         return Response({
             "code": "SUCCESS",
             "message": "success",
-            "data": {
-                "dramaId": drama.drama_id,
-                "name": drama.name,
-                "description": drama.description,
-                "cover": drama.cover_url,
-                "logo": drama.logo_url,
-                "episodeCount": drama.episode_count,
-                "orientation": drama.orientation,
-                "categories": drama.categories,
-                "views": drama.views,
-                "lastSynced": drama.last_synced.isoformat() if drama.last_synced else None,
-                "episodes": episodes,
-            }
+            "data": data,
         })
 
 
 class CachedEpisodePlayView(APIView):
-    """API view to get cached episode video URL."""
+    """API view to get cached episode video URL (refreshed from upstream when its token expires)."""
     
     def get(self, request, drama_id, episode_num):
         """
@@ -298,7 +537,7 @@ class CachedEpisodePlayView(APIView):
         Returns proxied m3u8 URL ready to play.
         """
         try:
-            episode = Episode.objects.get(
+            episode = Episode.objects.select_related('drama').get(
                 drama__drama_id=drama_id, 
                 episode_number=episode_num
             )
@@ -318,32 +557,15 @@ class CachedEpisodePlayView(APIView):
                 }
             }, status=status.HTTP_404_NOT_FOUND)
 
-        # ---------------------------------------------------------
-        # CRITICAL FIX: Fetch FRESH video URL from Upstream
-        # The stored video_url has a token that expires quickly.
-        # We must get a new token/url every time the user plays.
-        # ---------------------------------------------------------
-        try:
-            service = JoliboxService()
-            # Fetch fresh details from upstream
-            detail = service.get_drama_detail(drama_id, episode_num=episode_num)
-            
-            if detail.get('code') == 'SUCCESS':
-                play_info = detail.get('data', {}).get('playInfo', {})
-                fresh_video_url = play_info.get('episodeM3u8')
-                
-                if fresh_video_url:
-                    # Update our DB with the fresh URL (optional, but good for debugging)
-                    episode.video_url = fresh_video_url
-                    episode.save()
-                else:
-                    # Fallback to stored if upstream fails to give URL (unlikely if unlocked)
-                     pass
-        except Exception as e:
-            # If upstream fetch fails, fall back to stored URL (it might still work if recent)
-            print(f"Failed to refresh video URL: {e}")
+        # The stored video_url carries a token that expires; it's served while
+        # still valid and refreshed from upstream only when about to expire
+        get_play_url_resolver().resolve(episode)
+
+        # Buffered in memory, written to Drama.views in batches
+        view_counter = get_view_counter()
+        if view_counter:
+            view_counter.record(episode.drama_id)
 
-        
         # Build proxied URL for CORS handling
         # Use root-relative path to avoid Host header issues
         proxied_url = f"/api/proxy/m3u8/?url={quote(episode.video_url)}"
@@ -356,9 +578,67 @@ class CachedEpisodePlayView(APIView):
                 "dramaId": drama_id,
                 "dramaName": episode.drama.name,
                 "episodeNumber": episode.episode_number,
-                "videoUrl": episode.video_url, # This is now the FRESH url
+                "videoUrl": episode.video_url, # Valid for at least PLAY_URL_EXPIRY_MARGIN
                 "proxiedUrl": proxied_url,
                 "lastSynced": episode.last_synced.isoformat() if episode.last_synced else None,
             }
         })
 
+
+
+class CachedEpisodeBatchPlayView(APIView):
+    """API view to get playable URLs for a run of episodes (current + next ones) in one request."""
+
+    def get(self, request, drama_id):
+        """
+        Get video URLs for consecutive episodes from cache.
+
+        Query params:
+        - from: First episode number (default: 1)
+        - count: Number of episodes (default: 4, max: PLAY_URL_BATCH_MAX)
+
+        Episodes that don't exist are left out, locked ones come back without URLs.
+        """
+        try:
+            start = int(request.query_params.get('from', 1))
+            count = min(int(request.query_params.get('count', 4)), settings.PLAY_URL_BATCH_MAX)
+        except ValueError:
+            return Response(
+                {"code": "ERROR", "message": "from and count must be integers", "data": None},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        episodes = list(
+            Episode.objects.select_related('drama').filter(
+                drama__drama_id=drama_id,
+                episode_number__gte=start,
+                episode_number__lt=start + max(count, 0)
+            ).order_by('episode_number')
+        )
+        if not episodes:
+            return Response(
+                {"code": "ERROR", "message": "Episodes not found in cache", "data": None},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        unlocked = [e for e in episodes if e.is_unlocked]
+        get_play_url_resolver().resolve_many(unlocked)
+
+        return Response({
+            "code": "SUCCESS",
+            "message": "success",
+            "data": {
+                "dramaId": drama_id,
+                "dramaName": episodes[0].drama.name,
+                "episodes": [
+                    {
+                        "episodeNumber": e.episode_number,
+                        "isUnlocked": e.is_unlocked,
+                        "videoUrl": e.video_url if e.is_unlocked else None,
+                        "proxiedUrl": f"/api/proxy/m3u8/?url={quote(e.video_url)}" if e.is_unlocked else None,
+                        "lastSynced": e.last_synced.isoformat() if e.last_synced else None,
+                    }
+                    for e in episodes
+                ],
+            }
+        })
@@ -3,13 +3,13 @@ import django
 import asyncio
 from asgiref.sync import sync_to_async
 from django.conf import settings
-import aiohttp
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dramaflux.settings")
 django.setup()
 
 from dramas.sync_service import ReliableDramaSyncService
 from dramas.models import Drama
+from dramas.upstream import get_async_session
 
 async def refresh():
     try:
@@ -23,7 +23,7 @@ async def refresh():
             # If drama not found, we might need to fetch it first, but let's assume it is there since we saw it in API
             return
 
-        async with aiohttp.ClientSession() as session:
+        async with get_async_session() as session:
             # Unlock and verify (Refreshes the token in DB)
             success = await service.verify_and_unlock(session, drama, 1)
             